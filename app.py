@@ -1,419 +1,1475 @@
-from flask import Flask, render_template_string, request, jsonify, redirect, url_for
-from datetime import datetime
+from flask import Flask, render_template, request, jsonify, redirect, url_for, Response
+from flask.json.provider import DefaultJSONProvider
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import wraps
+from datetime import datetime, timedelta, timezone
+from bisect import bisect_left
 import sqlite3
 import os
 import json
+import threading
+import atexit
+import time
+import asyncio
+import argparse
+import io
+import re
+import sys
+import gzip
+import hashlib
+import mimetypes
+
+try:
+    import orjson
+except ImportError:  # opcional: sem ele o jsonify usa o json da biblioteca padrão
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # opcional: sem ele páginas e arquivos estáticos saem só em gzip
+    brotli = None
+
+class ProvedorJSON(DefaultJSONProvider):
+    """jsonify com orjson quando disponível (bem mais rápido em filas grandes)"""
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        corpo = orjson.dumps(obj, default=self.default, option=orjson.OPT_SORT_KEYS)
+        return self._app.response_class(corpo, mimetype=self.mimetype)
 
 app = Flask(__name__)
+app.json = ProvedorJSON(app)
 
 # Banco de dados
-DB_FILE = "pedidos_acougue.db"
+DB_FILE = os.environ.get("PEDIDOS_DB", "pedidos_acougue.db")
+
+# Intervalo (segundos) entre comentários de keep-alive no stream da produção
+STREAM_HEARTBEAT = 15
+
+# Notificação de mudanças na fila de produção
+# A versão da fila é um contador persistido no banco (tabela fila_estado) e
+# avançado por toda escrita; aqui fica a última versão conhecida pelo processo.
+_fila_cond = threading.Condition()
+_versao_fila = 0
+
+def etag_fila(versao):
+    """ETag da fila de pendentes para uma versão"""
+    return f'fila-{versao}'
+
+# Funções chamadas com cada versão nova (ex.: o laço asyncio do modo assíncrono)
+_ouvintes_fila = []
+
+def notificar_mudanca(versao):
+    """Registra a versão nova da fila e acorda quem está esperando no stream"""
+    global _versao_fila
+    with _fila_cond:
+        if versao <= _versao_fila:
+            return
+        _versao_fila = versao
+        _fila_cond.notify_all()
+    for ouvinte in list(_ouvintes_fila):
+        ouvinte(versao)
+
+def aguardar_mudanca(versao, timeout):
+    """Bloqueia até a fila sair da versão informada (ou estourar o timeout) e retorna a versão atual"""
+    with _fila_cond:
+        _fila_cond.wait_for(lambda: _versao_fila != versao, timeout)
+        return _versao_fila
+
+# Pool de conexões
+# Conexões ficam abertas e são reaproveitadas entre requisições; cada thread
+# usa no máximo uma por vez (chamadas aninhadas recebem a mesma conexão).
+POOL_MAX_OCIOSAS = 8
+BUSY_TIMEOUT_MS = 5000
+
+_pool = []
+_pool_lock = threading.Lock()
+_conexoes_abertas = set()
+_local = threading.local()
+
+class ConexaoMedida(sqlite3.Connection):
+    """Conexão que soma em _local.banco o tempo gasto no SQLite pela requisição atual.
+
+    Fora de uma requisição (vigia, arquivamento) não mede nada. O que o cursor ainda
+    busca depois do execute não entra, mas aqui quase toda consulta volta numa linha só.
+    """
+
+    def _medir(self, metodo, args):
+        medida = getattr(_local, 'banco', None)
+        if medida is None:
+            return metodo(self, *args)
+        inicio = time.perf_counter()
+        try:
+            return metodo(self, *args)
+        finally:
+            medida[0] += time.perf_counter() - inicio
+            medida[1] += 1
 
-def init_db():
-    """Cria tabela se não existir"""
-    nova_tabela = not os.path.exists(DB_FILE)
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-
-    if nova_tabela:
-        c.execute('''
-            CREATE TABLE pedidos (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                cliente TEXT NOT NULL,
-                telefone TEXT,
-                itens TEXT NOT NULL,
-                criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                status TEXT DEFAULT 'pendente',
-                retirar_as TEXT
-            )
-        ''')
-    else:
-        # Garante que a coluna retirar_as exista (ignora erro se já existir)
+    def execute(self, *args):
+        return self._medir(sqlite3.Connection.execute, args)
+
+    def executemany(self, *args):
+        return self._medir(sqlite3.Connection.executemany, args)
+
+    def commit(self):
+        return self._medir(sqlite3.Connection.commit, ())
+
+def _abrir_conexao():
+    """Abre uma conexão já configurada (WAL, synchronous NORMAL, busy_timeout)"""
+    conn = sqlite3.connect(DB_FILE, timeout=BUSY_TIMEOUT_MS / 1000, factory=ConexaoMedida,
+                           isolation_level=None, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    with _pool_lock:
+        _conexoes_abertas.add(conn)
+    return conn
+
+def _devolver_conexao(conn):
+    """Devolve a conexão ao pool (ou fecha, se o pool já estiver cheio)"""
+    if conn.in_transaction:
+        conn.rollback()
+    with _pool_lock:
+        if len(_pool) < POOL_MAX_OCIOSAS:
+            _pool.append(conn)
+            return
+        _conexoes_abertas.discard(conn)
+    conn.close()
+
+@contextmanager
+def conexao():
+    """Empresta uma conexão do pool pela duração do bloco"""
+    atual = getattr(_local, 'conn', None)
+    if atual is not None:
+        yield atual
+        return
+
+    with _pool_lock:
+        conn = _pool.pop() if _pool else None
+    if conn is None:
+        conn = _abrir_conexao()
+
+    _local.conn = conn
+    try:
+        yield conn
+    finally:
+        _local.conn = None
+        _devolver_conexao(conn)
+
+# Commits deste processo (e os ganchos que rodam logo depois) acontecem um de
+# cada vez, na mesma ordem em que o SQLite serializou as escritas
+_commit_lock = threading.Lock()
+
+@contextmanager
+def transacao():
+    """Transação de escrita (BEGIN IMMEDIATE) com commit ou rollback automático"""
+    with conexao() as conn:
+        if conn.in_transaction:
+            # Já existe uma transação aberta mais acima e ela decide o commit; um
+            # erro aqui dentro desfaz só este bloco (e os ganchos que ele agendou)
+            ganchos = len(_local.apos_commit)
+            conn.execute('SAVEPOINT aninhada')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK TO aninhada')
+                conn.execute('RELEASE aninhada')
+                del _local.apos_commit[ganchos:]
+                raise
+            conn.execute('RELEASE aninhada')
+            return
+        _local.apos_commit = []
+        conn.execute('BEGIN IMMEDIATE')
         try:
-            c.execute("ALTER TABLE pedidos ADD COLUMN retirar_as TEXT")
+            yield conn
+        except BaseException:
+            conn.rollback()
+            _local.apos_commit = []
+            raise
+        ganchos, _local.apos_commit = _local.apos_commit, []
+        with _commit_lock:
             conn.commit()
-        except Exception:
+            for gancho in ganchos:
+                gancho()
+
+def apos_commit(gancho):
+    """Agenda uma função para rodar quando a transação de escrita atual for confirmada"""
+    _local.apos_commit.append(gancho)
+
+@contextmanager
+def leitura():
+    """Transação só de leitura: todas as consultas do bloco veem o mesmo snapshot"""
+    with conexao() as conn:
+        if conn.in_transaction:
+            yield conn
+            return
+        conn.execute('BEGIN')
+        try:
+            yield conn
+        finally:
+            conn.rollback()
+
+def fechar_conexoes():
+    """Fecha todas as conexões do pool (chamado ao encerrar o processo)"""
+    with _pool_lock:
+        conexoes = list(_conexoes_abertas)
+        _conexoes_abertas.clear()
+        _pool.clear()
+    for conn in conexoes:
+        try:
+            conn.execute('PRAGMA optimize')
+            conn.close()
+        except sqlite3.Error:
             pass
 
-        # Garante que a coluna modificado exista
-        try:
-            c.execute("ALTER TABLE pedidos ADD COLUMN modificado INTEGER DEFAULT 0")
-            conn.commit()
-        except Exception:
-            pass   
+atexit.register(fechar_conexoes)
+
+def _depois_do_fork():
+    """No processo filho: conexões herdadas do pai não podem ser usadas nem fechadas aqui"""
+    global _pool, _conexoes_abertas, _local
+    _herdadas.extend(_conexoes_abertas)
+    _pool = []
+    _conexoes_abertas = set()
+    _local = threading.local()
+
+# Só guardadas para não serem coletadas (o close rodaria no filho)
+_herdadas = []
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_depois_do_fork)
+
+# Migrações do esquema
+# Cada função leva o banco da versão N para N+1; PRAGMA user_version guarda
+# quantas já foram aplicadas. Migrações novas entram sempre no fim da lista.
+
+def _migracao_tabela_pedidos(conn):
+    """Cria a tabela pedidos (ou completa as colunas de bancos antigos)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS pedidos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            cliente TEXT NOT NULL,
+            telefone TEXT,
+            itens TEXT NOT NULL,
+            criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            status TEXT DEFAULT 'pendente',
+            retirar_as TEXT,
+            modificado INTEGER DEFAULT 0
+        )
+    ''')
+    colunas = {row['name'] for row in conn.execute('PRAGMA table_info(pedidos)')}
+    if 'retirar_as' not in colunas:
+        conn.execute("ALTER TABLE pedidos ADD COLUMN retirar_as TEXT")
+    if 'modificado' not in colunas:
+        conn.execute("ALTER TABLE pedidos ADD COLUMN modificado INTEGER DEFAULT 0")
+
+def _migracao_indice_pendentes(conn):
+    """Índice parcial que atende a fila de pendentes sem varrer o histórico"""
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_pedidos_pendentes
+        ON pedidos (criado_em) WHERE status = 'pendente'
+    ''')
+
+def _valor_moido(item):
+    """Converte o 'moido' vindo do formulário (texto) para inteiro, quando houver"""
+    moido = item.get('moido')
+    try:
+        return int(moido) if moido not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+def _migracao_tabela_itens(conn):
+    """Move os itens do JSON em pedidos.itens para a tabela pedido_itens"""
+    conn.execute('''
+        CREATE TABLE pedido_itens (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            pedido_id INTEGER NOT NULL REFERENCES pedidos (id),
+            posicao INTEGER NOT NULL,
+            descricao TEXT NOT NULL,
+            corte TEXT,
+            moido INTEGER,
+            temperar TEXT,
+            cancelado INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('CREATE INDEX idx_pedido_itens_pedido ON pedido_itens (pedido_id, posicao)')
+
+    for pedido in conn.execute('SELECT id, itens FROM pedidos').fetchall():
+        conn.executemany('''
+            INSERT INTO pedido_itens (pedido_id, posicao, descricao, corte, moido, temperar)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', [
+            (pedido['id'], posicao, item.get('descricao', ''), item.get('corte'),
+             _valor_moido(item), item.get('temperar'))
+            for posicao, item in enumerate(json.loads(pedido['itens'] or '[]'))
+        ])
+
+    conn.execute('ALTER TABLE pedidos DROP COLUMN itens')
+
+def _migracao_versao_pedido(conn):
+    """Versão por pedido, usada no compare-and-swap das alterações de itens"""
+    conn.execute('ALTER TABLE pedidos ADD COLUMN versao INTEGER NOT NULL DEFAULT 0')
+
+def _migracao_versao_fila(conn):
+    """Contador global da fila e carimbo da última versão em que cada pedido mudou"""
+    conn.execute('''
+        CREATE TABLE fila_estado (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            versao INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('INSERT INTO fila_estado (id, versao) VALUES (1, 0)')
+    conn.execute('ALTER TABLE pedidos ADD COLUMN versao_fila INTEGER NOT NULL DEFAULT 0')
+    conn.execute('CREATE INDEX idx_pedidos_versao_fila ON pedidos (versao_fila)')
+
+def _migracao_arquivo(conn):
+    """Tabelas de arquivo para os pedidos prontos antigos (mesmas colunas das tabelas vivas)"""
+    conn.execute('''
+        CREATE TABLE pedidos_arquivo (
+            id INTEGER PRIMARY KEY,
+            cliente TEXT NOT NULL,
+            telefone TEXT,
+            criado_em TIMESTAMP,
+            status TEXT,
+            retirar_as TEXT,
+            modificado INTEGER,
+            versao INTEGER NOT NULL DEFAULT 0,
+            versao_fila INTEGER NOT NULL DEFAULT 0,
+            arquivado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('CREATE INDEX idx_pedidos_arquivo_criado ON pedidos_arquivo (criado_em)')
+    conn.execute('CREATE INDEX idx_pedidos_arquivo_versao_fila ON pedidos_arquivo (versao_fila)')
+    conn.execute('''
+        CREATE TABLE pedido_itens_arquivo (
+            id INTEGER PRIMARY KEY,
+            pedido_id INTEGER NOT NULL,
+            posicao INTEGER NOT NULL,
+            descricao TEXT NOT NULL,
+            corte TEXT,
+            moido INTEGER,
+            temperar TEXT,
+            cancelado INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('CREATE INDEX idx_pedido_itens_arquivo_pedido ON pedido_itens_arquivo (pedido_id, posicao)')
+    # Acha os candidatos ao arquivo sem varrer os pendentes
+    conn.execute('''
+        CREATE INDEX idx_pedidos_prontos
+        ON pedidos (criado_em) WHERE status = 'pronto'
+    ''')
+
+# Prazo de retirada
+# retirar_as guarda o "HH:MM" digitado (hora local); prazo é o mesmo instante em
+# UTC, comparável com criado_em, e é por ele que a fila de produção é ordenada.
+PRAZO_SEM_HORARIO_MIN = 60  # pedido sem horário de retirada entra como se fosse para daqui a 1h
+PRAZO_TOLERANCIA_MIN = 60   # horário que já passou há até 1h é de hoje (cliente adiantado); antes disso, amanhã
+EM_RISCO_MIN = 15           # faltando menos que isso para a retirada, o card fica destacado
+
+def _formatar_timestamp(momento):
+    """datetime UTC no formato do CURRENT_TIMESTAMP do SQLite"""
+    return momento.strftime('%Y-%m-%d %H:%M:%S')
+
+def calcular_prazo(retirar_as, criado_em):
+    """Prazo (texto UTC) de um pedido criado em criado_em (datetime UTC sem fuso) para retirar às retirar_as"""
+    criado_local = criado_em.replace(tzinfo=timezone.utc).astimezone()
+    try:
+        hora, minuto = (int(parte) for parte in retirar_as.split(':')[:2])
+        prazo = criado_local.replace(hour=hora, minute=minuto, second=0, microsecond=0)
+    except (AttributeError, ValueError):
+        prazo = criado_local + timedelta(minutes=PRAZO_SEM_HORARIO_MIN)
+    else:
+        if prazo < criado_local - timedelta(minutes=PRAZO_TOLERANCIA_MIN):
+            prazo += timedelta(days=1)
+    return _formatar_timestamp(prazo.astimezone(timezone.utc))
+
+def _migracao_prazo(conn):
+    """Coluna prazo (preenchida a partir de retirar_as) e índice da fila por prazo"""
+    for tabela in ('pedidos', 'pedidos_arquivo'):
+        conn.execute(f'ALTER TABLE {tabela} ADD COLUMN prazo TIMESTAMP')
+        conn.executemany(f'UPDATE {tabela} SET prazo = ? WHERE id = ?', [
+            (calcular_prazo(row['retirar_as'], datetime.strptime(row['criado_em'], '%Y-%m-%d %H:%M:%S')), row['id'])
+            for row in conn.execute(f'SELECT id, criado_em, retirar_as FROM {tabela} WHERE criado_em IS NOT NULL')
+        ])
+    conn.execute('DROP INDEX idx_pedidos_pendentes')
+    conn.execute('''
+        CREATE INDEX idx_pedidos_fila
+        ON pedidos (prazo, criado_em) WHERE status = 'pendente'
+    ''')
+
+# Finais do telefone (só dígitos) indexados como palavras à parte: a busca do FTS
+# casa só o começo de cada palavra, e quem procura um número costuma digitar o fim
+# (sem DDD, sem o nono dígito ou só os últimos quatro)
+TELEFONE_FINAIS = (4, 8, 9)
+
+def _telefone_busca(coluna):
+    """Expressão SQL com o telefone como digitado, só os dígitos e os finais de TELEFONE_FINAIS"""
+    digitos = f"COALESCE({coluna}, '')"
+    for caractere in '()- .+':
+        digitos = f"replace({digitos}, '{caractere}', '')"
+    finais = ''.join(f" || ' ' || substr({digitos}, -{n})" for n in TELEFONE_FINAIS)
+    return f"COALESCE({coluna}, '') || ' ' || {digitos}{finais}"
+
+def _migracao_busca(conn):
+    """Índice full-text (FTS5) de cliente e telefone do histórico, mais o índice por data"""
+    # Sem conteúdo próprio: guarda só o índice, o rowid é o id do pedido. Nome e
+    # telefone não mudam depois de criados e o arquivamento mantém o id, então
+    # basta indexar na inserção.
+    conn.execute('''
+        CREATE VIRTUAL TABLE pedidos_busca USING fts5(
+            cliente, telefone, content='', tokenize='unicode61 remove_diacritics 2'
+        )
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER pedidos_busca_inserir AFTER INSERT ON pedidos BEGIN
+            INSERT INTO pedidos_busca (rowid, cliente, telefone)
+            VALUES (new.id, new.cliente, {_telefone_busca('new.telefone')});
+        END
+    ''')
+    for tabela in ('pedidos', 'pedidos_arquivo'):
+        conn.execute(f'''
+            INSERT INTO pedidos_busca (rowid, cliente, telefone)
+            SELECT id, cliente, {_telefone_busca('telefone')} FROM {tabela}
+        ''')
+    conn.execute('CREATE INDEX idx_pedidos_criado ON pedidos (criado_em)')
+
+# Dia e hora locais de um criado_em (que é UTC), como as tabelas de agregados guardam
+def _dia_local(coluna):
+    return f"date({coluna}, 'localtime')"
+
+def _hora_local(coluna):
+    return f"CAST(strftime('%H', {coluna}, 'localtime') AS INTEGER)"
+
+def _agregar_item(ref, sinal, pedidos='pedidos', pesos=False):
+    """Corpo de trigger que soma `sinal` nos agregados para o item ref (new/old), se ele não estiver cancelado.
+
+    Com pesos=True também soma gramas e unidades (colunas que só existem depois de _migracao_quantidades).
+    """
+    colunas = valores = atualizacao = ''
+    if pesos:
+        colunas = ', gramas, unidades'
+        valores = f', {sinal} * COALESCE({ref}.gramas, 0), {sinal} * COALESCE({ref}.unidades, 0)'
+        atualizacao = ', gramas = gramas + excluded.gramas, unidades = unidades + excluded.unidades'
+    return f'''
+        INSERT INTO agregado_hora (dia, hora, pedidos, itens)
+        SELECT {_dia_local('criado_em')}, {_hora_local('criado_em')}, 0, {sinal}
+        FROM {pedidos} WHERE id = {ref}.pedido_id AND {ref}.cancelado = 0
+        ON CONFLICT (dia, hora) DO UPDATE SET itens = itens + {sinal};
+        INSERT INTO agregado_corte (dia, corte, temperar, itens{colunas})
+        SELECT {_dia_local('criado_em')}, COALESCE({ref}.corte, ''), COALESCE({ref}.temperar, ''), {sinal}{valores}
+        FROM {pedidos} WHERE id = {ref}.pedido_id AND {ref}.cancelado = 0
+        ON CONFLICT (dia, corte, temperar) DO UPDATE SET itens = itens + {sinal}{atualizacao};
+    '''
+
+def _migracao_agregados(conn):
+    """Agregados por dia/hora e por dia/corte/tempero, mantidos por triggers nas próprias escritas"""
+    conn.execute('''
+        CREATE TABLE agregado_hora (
+            dia TEXT NOT NULL,
+            hora INTEGER NOT NULL,
+            pedidos INTEGER NOT NULL DEFAULT 0,
+            itens INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (dia, hora)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE agregado_corte (
+            dia TEXT NOT NULL,
+            corte TEXT NOT NULL,
+            temperar TEXT NOT NULL,
+            itens INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (dia, corte, temperar)
+        ) WITHOUT ROWID
+    ''')
+
+    # Histórico que já existe (pedidos vivos e arquivados), de uma vez
+    conn.execute(f'''
+        INSERT INTO agregado_hora (dia, hora, pedidos, itens)
+        SELECT {_dia_local('criado_em')}, {_hora_local('criado_em')}, COUNT(*), SUM(itens)
+        FROM (
+            SELECT p.criado_em, (SELECT COUNT(*) FROM pedido_itens i
+                                  WHERE i.pedido_id = p.id AND i.cancelado = 0) AS itens
+            FROM pedidos p
+            UNION ALL
+            SELECT p.criado_em, (SELECT COUNT(*) FROM pedido_itens_arquivo i
+                                  WHERE i.pedido_id = p.id AND i.cancelado = 0)
+            FROM pedidos_arquivo p
+        )
+        WHERE criado_em IS NOT NULL
+        GROUP BY 1, 2
+    ''')
+    conn.execute(f'''
+        INSERT INTO agregado_corte (dia, corte, temperar, itens)
+        SELECT {_dia_local('criado_em')}, corte, temperar, COUNT(*)
+        FROM (
+            SELECT p.criado_em, COALESCE(i.corte, '') AS corte, COALESCE(i.temperar, '') AS temperar
+            FROM pedido_itens i JOIN pedidos p ON p.id = i.pedido_id
+            WHERE i.cancelado = 0
+            UNION ALL
+            SELECT p.criado_em, COALESCE(i.corte, ''), COALESCE(i.temperar, '')
+            FROM pedido_itens_arquivo i JOIN pedidos_arquivo p ON p.id = i.pedido_id
+            WHERE i.cancelado = 0
+        )
+        WHERE criado_em IS NOT NULL
+        GROUP BY 1, 2, 3
+    ''')
+
+    # Daqui em diante cada escrita ajusta os agregados na mesma transação. O
+    # arquivamento apaga das tabelas vivas sem mexer neles (não há trigger de DELETE).
+    conn.execute(f'''
+        CREATE TRIGGER agregar_pedido AFTER INSERT ON pedidos BEGIN
+            INSERT INTO agregado_hora (dia, hora, pedidos, itens)
+            VALUES ({_dia_local('new.criado_em')}, {_hora_local('new.criado_em')}, 1, 0)
+            ON CONFLICT (dia, hora) DO UPDATE SET pedidos = pedidos + 1;
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER agregar_item AFTER INSERT ON pedido_itens BEGIN
+            {_agregar_item('new', 1)}
+        END
+    ''')
+    # Cancelamento e modificação: sai o estado antigo, entra o novo
+    conn.execute(f'''
+        CREATE TRIGGER agregar_item_alterado AFTER UPDATE OF cancelado, corte, temperar ON pedido_itens BEGIN
+            {_agregar_item('old', -1)}
+            {_agregar_item('new', 1)}
+        END
+    ''')
+
+# Quantidades
+# A descrição do item é texto livre ("1kg", "1,5 kg", "500g", "meio quilo",
+# "2 unidades"); na gravação ela é lida uma vez e vira gramas e/ou unidades em
+# colunas numéricas, para os totais saírem direto do SQL.
+_GRAMAS_POR_UNIDADE = {
+    'kg': 1000, 'k': 1000, 'kgs': 1000, 'kilo': 1000, 'kilos': 1000, 'quilo': 1000, 'quilos': 1000,
+    'g': 1, 'gr': 1, 'grs': 1, 'grama': 1, 'gramas': 1,
+}
+_CONTAGENS = {
+    'un', 'und', 'unid', 'unids', 'unidade', 'unidades', 'pc', 'pç', 'pcs', 'peca', 'pecas', 'peça', 'peças',
+    'pacote', 'pacotes', 'bandeja', 'bandejas',
+}
+_POR_EXTENSO = {'meio': 0.5, 'meia': 0.5, 'um': 1, 'uma': 1, 'dois': 2, 'duas': 2, 'tres': 3, 'três': 3}
+_QUANTIDADE_RE = re.compile(
+    r'\b(\d{1,3}(?:\.\d{3})+(?:,\d+)?|\d+(?:[.,]\d+)?(?:/\d+)?|meio|meia|uma?|dois|duas|tr[eê]s)\s*([a-zçê]+)\b',
+    re.IGNORECASE)
+# Ponto seguido de exatamente três dígitos pode ser separador de milhar ("1.000g",
+# "1.500,5 g") ou decimal, como a balança mostra quilos ("1.500kg", "0.500kg").
+# Só vira milhar quando não tem outra leitura: em gramas com parte inteira
+# diferente de zero, ou quando há mais de um ponto ou vírgula depois dele.
+_MILHAR_RE = re.compile(r'\d{1,3}(?:\.\d{3})+(?:,\d+)?')
+
+def _numero(texto, em_gramas=False):
+    '''Número escrito à brasileira (vírgula decimal, ponto de milhar) ou com ponto decimal'''
+    if _MILHAR_RE.fullmatch(texto) and (
+            texto.count('.') > 1 or ',' in texto or (em_gramas and int(texto.split('.')[0]))):
+        texto = texto.replace('.', '')
+    return float(texto.replace(',', '.'))
+
+def interpretar_quantidade(descricao):
+    """(gramas, unidades) lidos da descrição; cada um é None quando a descrição não traz essa medida"""
+    gramas = unidades = None
+    for numero, unidade in _QUANTIDADE_RE.findall(descricao or ''):
+        numero, unidade = numero.lower(), unidade.lower()
+        em_gramas = _GRAMAS_POR_UNIDADE.get(unidade) == 1
+        if numero in _POR_EXTENSO:
+            valor = _POR_EXTENSO[numero]
+        elif '/' in numero:
+            dividendo, divisor = numero.split('/')
+            if not int(divisor):
+                continue
+            valor = _numero(dividendo, em_gramas) / int(divisor)
+        else:
+            valor = _numero(numero, em_gramas)
+        if unidade in _GRAMAS_POR_UNIDADE:
+            gramas = (gramas or 0) + valor * _GRAMAS_POR_UNIDADE[unidade]
+        elif unidade in _CONTAGENS:
+            unidades = (unidades or 0) + valor
+    if gramas is not None:
+        gramas = round(gramas)
+    if unidades is not None and unidades == int(unidades):
+        unidades = int(unidades)
+    return gramas, unidades
+
+def _migracao_quantidades(conn):
+    """Colunas gramas/unidades nos itens (preenchidas a partir da descrição) e somadas nos agregados"""
+    for tabela in ('pedido_itens', 'pedido_itens_arquivo'):
+        conn.execute(f'ALTER TABLE {tabela} ADD COLUMN gramas INTEGER')
+        conn.execute(f'ALTER TABLE {tabela} ADD COLUMN unidades NUMERIC')
+    conn.execute('ALTER TABLE agregado_corte ADD COLUMN gramas INTEGER NOT NULL DEFAULT 0')
+    conn.execute('ALTER TABLE agregado_corte ADD COLUMN unidades NUMERIC NOT NULL DEFAULT 0')
+
+    # Os triggers novos já somam gramas e unidades; os de agora saem antes do
+    # preenchimento para ele não mexer nos agregados (que são refeitos abaixo)
+    conn.execute('DROP TRIGGER agregar_item')
+    conn.execute('DROP TRIGGER agregar_item_alterado')
+    for tabela in ('pedido_itens', 'pedido_itens_arquivo'):
+        _preencher_quantidades(conn, tabela)
+
+    conn.execute(f'''
+        UPDATE agregado_corte SET gramas = somas.gramas, unidades = somas.unidades
+        FROM (
+            SELECT {_dia_local('criado_em')} AS dia, corte, temperar,
+                   SUM(gramas) AS gramas, SUM(unidades) AS unidades
+            FROM (
+                SELECT p.criado_em, COALESCE(i.corte, '') AS corte, COALESCE(i.temperar, '') AS temperar,
+                       COALESCE(i.gramas, 0) AS gramas, COALESCE(i.unidades, 0) AS unidades
+                FROM pedido_itens i JOIN pedidos p ON p.id = i.pedido_id
+                WHERE i.cancelado = 0
+                UNION ALL
+                SELECT p.criado_em, COALESCE(i.corte, ''), COALESCE(i.temperar, ''),
+                       COALESCE(i.gramas, 0), COALESCE(i.unidades, 0)
+                FROM pedido_itens_arquivo i JOIN pedidos_arquivo p ON p.id = i.pedido_id
+                WHERE i.cancelado = 0
+            )
+            WHERE criado_em IS NOT NULL
+            GROUP BY 1, 2, 3
+        ) AS somas
+        WHERE agregado_corte.dia = somas.dia AND agregado_corte.corte = somas.corte
+          AND agregado_corte.temperar = somas.temperar
+    ''')
+
+    conn.execute(f'''
+        CREATE TRIGGER agregar_item AFTER INSERT ON pedido_itens BEGIN
+            {_agregar_item('new', 1, pesos=True)}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER agregar_item_alterado
+        AFTER UPDATE OF cancelado, corte, temperar, gramas, unidades ON pedido_itens BEGIN
+            {_agregar_item('old', -1, pesos=True)}
+            {_agregar_item('new', 1, pesos=True)}
+        END
+    ''')
+    # Itens arquivados só mudam se as quantidades forem relidas (reprocessar_quantidades)
+    conn.execute(f'''
+        CREATE TRIGGER agregar_item_arquivo_alterado
+        AFTER UPDATE OF gramas, unidades ON pedido_itens_arquivo BEGIN
+            {_agregar_item('old', -1, 'pedidos_arquivo', pesos=True)}
+            {_agregar_item('new', 1, 'pedidos_arquivo', pesos=True)}
+        END
+    ''')
+
+QUANTIDADES_LOTE = 1000
+
+def _preencher_quantidades(conn, tabela, desde_id=0, limite=None):
+    """Relê a descrição dos itens de `tabela` com id > desde_id e grava gramas/unidades; retorna o último id visto"""
+    consulta = f'SELECT id, descricao FROM {tabela} WHERE id > ? ORDER BY id'
+    if limite:
+        consulta += f' LIMIT {int(limite)}'
+    linhas = conn.execute(consulta, (desde_id,)).fetchall()
+    conn.executemany(f'''
+        UPDATE {tabela} SET gramas = ?, unidades = ?
+        WHERE id = ? AND (gramas IS NOT ? OR unidades IS NOT ?)
+    ''', [
+        (*quantidade, row['id'], *quantidade)
+        for row in linhas
+        for quantidade in [interpretar_quantidade(row['descricao'])]
+    ])
+    return linhas[-1]['id'] if linhas else None
+
+def reprocessar_quantidades():
+    """Relê a quantidade de todos os itens (vivos e arquivados), em lotes; útil quando o leitor melhora"""
+    for tabela in ('pedido_itens', 'pedido_itens_arquivo'):
+        ultimo = 0
+        while ultimo is not None:
+            with transacao() as conn:
+                ultimo = _preencher_quantidades(conn, tabela, ultimo, QUANTIDADES_LOTE)
+    # O JSON dos pendentes (em cache em cada processo) traz as quantidades: carimba para recarregar
+    with transacao() as conn:
+        pendentes = [row[0] for row in conn.execute("SELECT id FROM pedidos WHERE status = 'pendente'")]
+        if pendentes:
+            _carimbar_fila(conn, *pendentes)
+
+def _migracao_idempotencia(conn):
+    """Respostas já dadas por chave de idempotência, para repetir sem gravar de novo"""
+    conn.execute('''
+        CREATE TABLE idempotencia (
+            chave TEXT PRIMARY KEY,
+            rota TEXT NOT NULL,
+            status INTEGER NOT NULL,
+            resposta TEXT NOT NULL,
+            criado_em TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('CREATE INDEX idx_idempotencia_criado ON idempotencia (criado_em)')
+
+def _migracao_busca_finais(conn):
+    """Reindexa os telefones da busca com os finais do número (TELEFONE_FINAIS)"""
+    conn.execute('DROP TRIGGER pedidos_busca_inserir')
+    conn.execute(f'''
+        CREATE TRIGGER pedidos_busca_inserir AFTER INSERT ON pedidos BEGIN
+            INSERT INTO pedidos_busca (rowid, cliente, telefone)
+            VALUES (new.id, new.cliente, {_telefone_busca('new.telefone')});
+        END
+    ''')
+    conn.execute("INSERT INTO pedidos_busca (pedidos_busca) VALUES ('delete-all')")
+    for tabela in ('pedidos', 'pedidos_arquivo'):
+        conn.execute(f'''
+            INSERT INTO pedidos_busca (rowid, cliente, telefone)
+            SELECT id, cliente, {_telefone_busca('telefone')} FROM {tabela}
+        ''')
 
-    conn.close()
+def _migracao_pronto_em(conn):
+    """Quando cada pedido ficou pronto, que é de onde o arquivamento conta os dias"""
+    for tabela in ('pedidos', 'pedidos_arquivo'):
+        conn.execute(f'ALTER TABLE {tabela} ADD COLUMN pronto_em TIMESTAMP')
+        # Dos que já estavam prontos não se sabe a hora; a criação é o melhor palpite
+        conn.execute(f"UPDATE {tabela} SET pronto_em = criado_em WHERE status = 'pronto'")
+    conn.execute('DROP INDEX idx_pedidos_prontos')
+    conn.execute('''
+        CREATE INDEX idx_pedidos_prontos
+        ON pedidos (pronto_em) WHERE status = 'pronto'
+    ''')
+
+MIGRACOES = [
+    _migracao_tabela_pedidos,
+    _migracao_indice_pendentes,
+    _migracao_tabela_itens,
+    _migracao_versao_pedido,
+    _migracao_versao_fila,
+    _migracao_arquivo,
+    _migracao_prazo,
+    _migracao_busca,
+    _migracao_agregados,
+    _migracao_quantidades,
+    _migracao_idempotencia,
+    _migracao_busca_finais,
+    _migracao_pronto_em,
+]
+
+# Processo em que init_db já rodou (servidores com vários workers importam o app sem chamá-lo)
+_inicializado = {'pid': None}
+
+# Versão mínima do SQLite (a que vem com o Python): as migrações e consultas usam
+# ALTER TABLE ... DROP COLUMN e RETURNING (3.35), UPDATE ... FROM (3.33) e FTS5
+SQLITE_MINIMO = (3, 35, 0)
+
+def verificar_sqlite():
+    """Falha com uma mensagem clara se o SQLite deste Python for antigo demais"""
+    if sqlite3.sqlite_version_info < SQLITE_MINIMO:
+        minimo = '.'.join(map(str, SQLITE_MINIMO))
+        raise RuntimeError(f'O Sistema de Pedidos precisa do SQLite {minimo} ou mais novo; '
+                           f'este Python usa o {sqlite3.sqlite_version}')
+
+def init_db():
+    """Aplica as migrações que ainda não rodaram neste banco e carrega a fila em memória"""
+    verificar_sqlite()
+    with conexao() as conn:
+        atualizado = conn.execute('PRAGMA user_version').fetchone()[0] >= len(MIGRACOES)
+
+    if not atualizado:
+        with transacao() as conn:
+            # Relê dentro da transação: outro processo pode ter migrado antes
+            versao = conn.execute('PRAGMA user_version').fetchone()[0]
+            for numero, migracao in enumerate(MIGRACOES[versao:], start=versao + 1):
+                migracao(conn)
+                conn.execute(f'PRAGMA user_version = {numero}')
+
+    _cache_fila.carregar()
+    _inicializado['pid'] = os.getpid()
+
+class ConflitoVersao(Exception):
+    """O pedido não está mais na versão (ou no estado) que o cliente conhecia"""
+
+    def __init__(self, pedido_id):
+        super().__init__(f'Pedido {pedido_id} foi alterado por outra tela')
+        self.pedido_id = pedido_id
+
+# Lista de itens ativos de um pedido (alias p), montada em JSON pelo próprio SQLite
+_ITENS_JSON = '''
+    (SELECT json_group_array(json_object(
+                'id', i.id, 'descricao', i.descricao, 'corte', i.corte,
+                'moido', i.moido, 'temperar', i.temperar,
+                'gramas', i.gramas, 'unidades', i.unidades))
+       FROM (SELECT * FROM pedido_itens
+              WHERE pedido_id = p.id AND cancelado = 0
+              ORDER BY posicao) AS i)
+'''
+
+# Pedido inteiro no formato da API, como objeto JSON
+_PEDIDO_JSON = f'''
+    json_object('id', p.id, 'cliente', p.cliente, 'telefone', p.telefone,
+                'criado_em', p.criado_em, 'retirar_as', p.retirar_as,
+                'prazo', strftime('%Y-%m-%dT%H:%M:%SZ', p.prazo),
+                'modificado', p.modificado, 'versao', p.versao,
+                'itens', json({_ITENS_JSON}))
+'''
+
+_SELECT_PEDIDO = f'''
+    SELECT p.id, p.cliente, p.telefone, p.criado_em, p.retirar_as, p.prazo, p.modificado, p.versao, p.status,
+           {_ITENS_JSON} AS itens
+    FROM pedidos p
+'''
+
+# O mesmo SELECT lendo das tabelas de arquivo
+_SELECT_PEDIDO_ARQUIVO = (_SELECT_PEDIDO
+                          .replace('FROM pedido_itens', 'FROM pedido_itens_arquivo')
+                          .replace('FROM pedidos p', 'FROM pedidos_arquivo p'))
 
 def get_pedidos_pendentes():
-    """Retorna pedidos pendentes ordenados por horário de criação"""
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute('SELECT * FROM pedidos WHERE status = "pendente" ORDER BY criado_em ASC')
-    pedidos = c.fetchall()
-    conn.close()
-    return pedidos
+    """Retorna pedidos pendentes na ordem da fila: prazo de retirada, depois chegada (itens já em JSON)"""
+    with conexao() as conn:
+        return conn.execute(_SELECT_PEDIDO + """
+            WHERE p.status = 'pendente'
+            ORDER BY p.prazo, p.criado_em
+        """).fetchall()
+
+# Acima disso o cliente está tão atrasado que é mais barato mandar a fila inteira
+DELTA_MAX_VERSOES = 1000
+
+def get_delta_fila(desde):
+    """Mudanças na fila desde uma versão: (versao, alterados, removidos, ordem), os três últimos em texto JSON.
+
+    alterados traz os pedidos pendentes novos ou modificados; removidos, os ids que
+    saíram da fila; ordem, os ids pendentes na ordem de exibição.
+    """
+    with leitura() as conn:
+        versao = conn.execute('SELECT versao FROM fila_estado').fetchone()[0]
+        alterados = conn.execute(f"""
+            SELECT json_group_array(json({_PEDIDO_JSON}))
+            FROM pedidos p
+            WHERE p.versao_fila > ? AND p.status = 'pendente'
+        """, (desde,)).fetchone()[0]
+        # Quem saiu da fila pode já ter ido para o arquivo
+        removidos = conn.execute('''
+            SELECT json_group_array(id) FROM (
+                SELECT id FROM pedidos WHERE versao_fila > ? AND status != 'pendente'
+                UNION ALL
+                SELECT id FROM pedidos_arquivo WHERE versao_fila > ?
+            )
+        ''', (desde, desde)).fetchone()[0]
+        ordem = conn.execute('''
+            SELECT json_group_array(id) FROM (
+                SELECT id FROM pedidos WHERE status = 'pendente' ORDER BY prazo, criado_em
+            )
+        ''').fetchone()[0]
+    return versao, alterados, removidos, ordem
+
+# Colunas que o cache da fila guarda de cada pedido
+_SELECT_ENTRADA_CACHE = f'''
+    SELECT p.id, p.status, p.versao_fila, p.prazo, p.criado_em, {_PEDIDO_JSON} AS json
+    FROM pedidos p
+'''
+
+class CacheFila:
+    """Pedidos pendentes em memória, mantidos pelas próprias escritas (write-through).
+
+    Cada entrada guarda o JSON do pedido já montado pelo SQLite, então responder a
+    API é só juntar texto. Escritas de outros processos são trazidas do banco pelo
+    carimbo versao_fila (ver _vigiar_banco).
+    """
+
+    REMOVIDOS_MAX = 1000
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.versao = None        # None: ainda não carregado
+        self.desatualizado = True # precisa sincronizar com o banco antes de servir
+        self.pedidos = {}         # id -> (versao_fila, chave de ordenação, json, itens, prazo de retirada)
+        self.removidos = deque()  # (versao_fila, id) dos que saíram da fila
+        self.removidos_desde = 0  # deltas a partir desta versão saem da memória
+        self.lotes = {}           # (corte, moido, temperar) -> {id do pedido: [itens]}
+        self._ordem = None
+        self._corpo = None
+        self._lotes_corpo = None
+
+    def carregar(self):
+        """Recarrega tudo do banco num snapshot só"""
+        with _commit_lock, leitura() as conn:
+            versao = conn.execute('SELECT versao FROM fila_estado').fetchone()[0]
+            linhas = conn.execute(_SELECT_ENTRADA_CACHE + "WHERE p.status = 'pendente'").fetchall()
+            with self.lock:
+                self.pedidos = {row['id']: self._entrada(row) for row in linhas}
+                self.lotes = {}
+                for pedido_id, entrada in self.pedidos.items():
+                    self._incluir_nos_lotes(pedido_id, entrada[3])
+                self.removidos.clear()
+                self.removidos_desde = versao
+                self.versao = versao
+                self.desatualizado = False
+                self._ordem = self._corpo = self._lotes_corpo = None
+        notificar_mudanca(versao)
+
+    def sincronizar(self):
+        """Traz do banco só os pedidos carimbados depois da versão do cache"""
+        if self.versao is None:
+            self.carregar()
+            return
+        with _commit_lock, leitura() as conn:
+            versao = conn.execute('SELECT versao FROM fila_estado').fetchone()[0]
+            if versao >= self.versao:
+                linhas = conn.execute(_SELECT_ENTRADA_CACHE + '''
+                    WHERE p.versao_fila > ? ORDER BY p.versao_fila
+                ''', (self.versao,)).fetchall()
+                with self.lock:
+                    self._aplicar_linhas(linhas)
+                    self.versao = versao
+                    self.desatualizado = False
+        if versao < self.versao:
+            # Contador voltou (banco restaurado de backup): só recarregando tudo
+            self.carregar()
+            return
+        notificar_mudanca(versao)
+
+    def aplicar(self, versao, linhas):
+        """Aplica o estado novo dos pedidos gravados numa transação (linhas de _SELECT_ENTRADA_CACHE)"""
+        with self.lock:
+            if self.desatualizado or versao <= self.versao:
+                return
+            if versao != self.versao + 1:
+                # Pulou versão: outro processo escreveu no meio; o vigia (ou a próxima leitura) sincroniza
+                self.desatualizado = True
+                return
+            self._aplicar_linhas(linhas)
+            self.versao = versao
+
+    @staticmethod
+    def _entrada(row):
+        # Mesma ordem do ORDER BY prazo, criado_em do SQL (prazo nulo vem antes)
+        pedido = json.loads(row['json'])
+        itens = [((item['corte'], item['moido'], item['temperar']), item) for item in pedido['itens']]
+        # Só quem marcou horário tem prazo de verdade; os demais só usam o prazo para ordenar
+        retirada = row['prazo'] if pedido['retirar_as'] else None
+        return row['versao_fila'], (row['prazo'] or '', row['criado_em'], row['id']), row['json'], itens, retirada
+
+    def _incluir_nos_lotes(self, pedido_id, itens):
+        for chave, item in itens:
+            self.lotes.setdefault(chave, {}).setdefault(pedido_id, []).append(item)
+
+    def _tirar_dos_lotes(self, pedido_id, itens):
+        for chave in {chave for chave, _ in itens}:
+            pedidos = self.lotes[chave]
+            del pedidos[pedido_id]
+            if not pedidos:
+                del self.lotes[chave]
+
+    def _aplicar_linhas(self, linhas):
+        for row in linhas:
+            anterior = self.pedidos.pop(row['id'], None)
+            if anterior is not None:
+                self._tirar_dos_lotes(row['id'], anterior[3])
+            if row['status'] == 'pendente':
+                entrada = self.pedidos[row['id']] = self._entrada(row)
+                self._incluir_nos_lotes(row['id'], entrada[3])
+            elif anterior is not None:
+                self.removidos.append((row['versao_fila'], row['id']))
+        while len(self.removidos) > self.REMOVIDOS_MAX:
+            self.removidos_desde = self.removidos.popleft()[0]
+        self._ordem = self._corpo = self._lotes_corpo = None
+
+    def ordem(self):
+        """Ids pendentes na ordem de exibição"""
+        with self.lock:
+            if self._ordem is None:
+                self._ordem = sorted(self.pedidos, key=lambda pid: self.pedidos[pid][1])
+            return self._ordem
+
+    def lotes_json(self):
+        """(versao, texto JSON dos lotes): itens pendentes iguais agrupados por (corte, moido, temperar).
+
+        Lotes com mais pedidos vêm primeiro; no empate, o que tem o pedido mais urgente.
+        Dentro de cada lote os pedidos seguem a ordem da fila. prazo_retirada é o
+        horário marcado mais cedo entre os pedidos do lote (None se nenhum marcou).
+        """
+        with self.lock:
+            if self._lotes_corpo is None:
+                posicao = {pid: i for i, pid in enumerate(self.ordem())}
+                lotes = []
+                for (corte, moido, temperar), pedidos in self.lotes.items():
+                    ids = sorted(pedidos, key=posicao.__getitem__)
+                    prazo = self.pedidos[ids[0]][1][0]
+                    retirada = min((self.pedidos[pid][4] for pid in ids if self.pedidos[pid][4]), default=None)
+                    itens = [item for itens_pedido in pedidos.values() for item in itens_pedido]
+                    lotes.append({
+                        'corte': corte,
+                        'moido': moido,
+                        'temperar': temperar,
+                        'itens': len(itens),
+                        'gramas': sum(item['gramas'] or 0 for item in itens),
+                        'unidades': sum(item['unidades'] or 0 for item in itens),
+                        'prazo': prazo.replace(' ', 'T') + 'Z' if prazo else None,
+                        'prazo_retirada': retirada.replace(' ', 'T') + 'Z' if retirada else None,
+                        'pedidos': [
+                            {'id': pid, 'descricoes': [item['descricao'] for item in pedidos[pid]]}
+                            for pid in ids
+                        ],
+                    })
+                lotes.sort(key=lambda lote: (-len(lote['pedidos']), posicao[lote['pedidos'][0]['id']]))
+                self._lotes_corpo = json.dumps(lotes, ensure_ascii=False)
+            return self.versao, self._lotes_corpo
+
+    def em_risco(self):
+        """Quantos pendentes com horário de retirada vencem em menos de EM_RISCO_MIN minutos (ou já venceram)"""
+        limite = _formatar_timestamp(datetime.now(timezone.utc) + timedelta(minutes=EM_RISCO_MIN))
+        with self.lock:
+            total = 0
+            for pid in self.ordem():
+                if self.pedidos[pid][1][0] >= limite:
+                    break
+                if self.pedidos[pid][4]:
+                    total += 1
+            return total
+
+    def completo(self):
+        """(versao, texto JSON do array com todos os pendentes)"""
+        with self.lock:
+            if self._corpo is None:
+                self._corpo = '[' + ','.join(self.pedidos[pid][2] for pid in self.ordem()) + ']'
+            return self.versao, self._corpo
+
+    def delta(self, desde):
+        """Mesmo formato de get_delta_fila, ou None se a memória não cobre essa versão"""
+        with self.lock:
+            if desde < self.removidos_desde:
+                return None
+            alterados = [entrada[2] for entrada in self.pedidos.values() if entrada[0] > desde]
+            removidos = [pid for versao, pid in self.removidos if versao > desde]
+            return (self.versao, '[' + ','.join(alterados) + ']',
+                    json.dumps(removidos), json.dumps(self.ordem()))
+
+_cache_fila = CacheFila()
+
+# Vários processos (workers) no mesmo banco
+# Cada processo tem uma thread que olha PRAGMA data_version numa conexão própria;
+# quando outro processo confirma uma escrita, o valor muda, e o cache local é
+# sincronizado pelo carimbo versao_fila (o que também acorda os streams daqui).
+# Escritas feitas fora do app que não avançam fila_estado não são percebidas.
+VIGIA_INTERVALO_S = 0.05
+
+_vigia = {'pid': None}
+_vigia_lock = threading.Lock()
+
+def _vigiar_banco():
+    """Laço da thread vigia: sincroniza o cache quando outra conexão grava uma versão nova"""
+    conn = _abrir_conexao()
+    data_version = None
+    while True:
+        time.sleep(VIGIA_INTERVALO_S)
+        try:
+            atual = conn.execute('PRAGMA data_version').fetchone()[0]
+            if atual == data_version:
+                continue
+            data_version = atual
+            versao = conn.execute('SELECT versao FROM fila_estado').fetchone()[0]
+            if _cache_fila.desatualizado or versao != _cache_fila.versao:
+                _cache_fila.sincronizar()
+        except sqlite3.Error as erro:
+            app.logger.warning('Vigia do banco: %s', erro)
+            data_version = None
+
+def _garantir_vigia():
+    """Sobe a thread vigia deste processo (uma por pid, então também vale depois de um fork)"""
+    if _vigia['pid'] == os.getpid():
+        return
+    with _vigia_lock:
+        if _vigia['pid'] == os.getpid():
+            return
+        threading.Thread(target=_vigiar_banco, name='vigia-banco', daemon=True).start()
+        _vigia['pid'] = os.getpid()
+
+def cache_fila():
+    """O cache da fila, sincronizado com o banco"""
+    if _cache_fila.desatualizado:
+        _cache_fila.sincronizar()
+    return _cache_fila
+
+def _publicar(versao, linhas):
+    """Depois do commit: atualiza o cache e acorda o stream"""
+    _cache_fila.aplicar(versao, linhas)
+    notificar_mudanca(versao)
+
+def _carimbar_fila(conn, *pedido_ids):
+    """Avança a versão global da fila, grava nela os pedidos alterados e agenda a publicação"""
+    versao = conn.execute('UPDATE fila_estado SET versao = versao + 1 RETURNING versao').fetchone()[0]
+    conn.executemany('UPDATE pedidos SET versao_fila = ? WHERE id = ?', [(versao, pid) for pid in pedido_ids])
+    marcadores = ', '.join('?' * len(pedido_ids))
+    linhas = conn.execute(_SELECT_ENTRADA_CACHE + f'WHERE p.id IN ({marcadores})', pedido_ids).fetchall()
+    apos_commit(lambda: _publicar(versao, linhas))
+    return versao
+
+def get_pedido(pedido_id):
+    """Retorna um pedido (qualquer status, inclusive já arquivado) ou None"""
+    with leitura() as conn:
+        return (conn.execute(_SELECT_PEDIDO + 'WHERE p.id = ?', (pedido_id,)).fetchone()
+                or conn.execute(_SELECT_PEDIDO_ARQUIVO + 'WHERE p.id = ?', (pedido_id,)).fetchone())
+
+# Histórico
+HISTORICO_POR_PAGINA = 50
+HISTORICO_MAX_POR_PAGINA = 200
+
+_PONTUACAO_TELEFONE = re.compile(r'[()\-.+]')
+
+def _termos_busca(texto):
+    """Texto livre da busca como consulta FTS5: cada palavra vira um prefixo, todas obrigatórias.
+
+    Pedaços de telefone com pontuação ("9999-1234", "(34)") viram só os dígitos,
+    que casam com o número inteiro ou com um dos finais indexados.
+    """
+    termos = []
+    for termo in texto.split():
+        digitos = _PONTUACAO_TELEFONE.sub('', termo)
+        termos.append(digitos if digitos.isdigit() else termo.replace('"', ''))
+    return ' '.join(f'"{termo}"*' for termo in termos if termo)
+
+def buscar_historico(texto=None, de=None, ate=None, status=None, apos=None, limite=HISTORICO_POR_PAGINA):
+    """Pedidos (vivos e arquivados) do mais novo para o mais antigo, paginados por cursor.
+
+    de/ate são limites de criado_em em UTC (ate exclusivo); apos é o (criado_em, id)
+    do último pedido da página anterior. Retorna as linhas no formato de _SELECT_PEDIDO.
+    """
+    filtros, parametros = [], []
+    consulta = _termos_busca(texto or '')
+    if consulta:
+        filtros.append('p.id IN (SELECT rowid FROM pedidos_busca WHERE pedidos_busca MATCH ?)')
+        parametros.append(consulta)
+    if de:
+        filtros.append('p.criado_em >= ?')
+        parametros.append(de)
+    if ate:
+        filtros.append('p.criado_em < ?')
+        parametros.append(ate)
+    if status:
+        filtros.append('p.status = ?')
+        parametros.append(status)
+    if apos:
+        filtros.append('(p.criado_em, p.id) < (?, ?)')
+        parametros.extend(apos)
+    where = ('WHERE ' + ' AND '.join(filtros)) if filtros else ''
+
+    # Cada tabela já devolve só o necessário pelo índice de criado_em; o UNION junta as duas páginas
+    pagina = f'ORDER BY p.criado_em DESC, p.id DESC LIMIT {int(limite)}'
+    with leitura() as conn:
+        return conn.execute(f'''
+            SELECT * FROM ({_SELECT_PEDIDO} {where} {pagina})
+            UNION ALL
+            SELECT * FROM ({_SELECT_PEDIDO_ARQUIVO} {where} {pagina})
+            ORDER BY criado_em DESC, id DESC
+            LIMIT {int(limite)}
+        ''', parametros * 2).fetchall()
+
+# Relatórios (leem só as tabelas de agregados)
+def get_relatorio(de, ate):
+    """Totais entre os dias locais de e ate ('AAAA-MM-DD', inclusive): por dia, por hora do dia e por corte"""
+    with leitura() as conn:
+        por_dia = conn.execute('''
+            SELECT dia, SUM(pedidos) AS pedidos, SUM(itens) AS itens
+            FROM agregado_hora WHERE dia BETWEEN ? AND ?
+            GROUP BY dia ORDER BY dia
+        ''', (de, ate)).fetchall()
+        por_hora = conn.execute('''
+            SELECT hora, SUM(pedidos) AS pedidos, SUM(itens) AS itens
+            FROM agregado_hora WHERE dia BETWEEN ? AND ?
+            GROUP BY hora ORDER BY hora
+        ''', (de, ate)).fetchall()
+        por_corte = conn.execute('''
+            SELECT corte, temperar, SUM(itens) AS itens, SUM(gramas) AS gramas, SUM(unidades) AS unidades
+            FROM agregado_corte WHERE dia BETWEEN ? AND ?
+            GROUP BY corte, temperar HAVING SUM(itens) > 0
+        ''', (de, ate)).fetchall()
+
+    cortes, temperar = {}, {}
+    for row in por_corte:
+        corte = cortes.setdefault(row['corte'], {
+            'corte': row['corte'], 'itens': 0, 'gramas': 0, 'unidades': 0, 'temperar': {},
+        })
+        corte['itens'] += row['itens']
+        corte['gramas'] += row['gramas']
+        corte['unidades'] += row['unidades']
+        corte['temperar'][row['temperar']] = row['itens']
+        temperar[row['temperar']] = temperar.get(row['temperar'], 0) + row['itens']
+    total_itens = sum(temperar.values())
+    return {
+        'de': de,
+        'ate': ate,
+        'pedidos': sum(row['pedidos'] for row in por_dia),
+        'itens': total_itens,
+        'gramas': sum(corte['gramas'] for corte in cortes.values()),
+        'por_dia': [dict(row) for row in por_dia],
+        'por_hora': [dict(row) for row in por_hora],
+        'por_corte': sorted(cortes.values(), key=lambda corte: -corte['itens']),
+        'temperar': {
+            opcao: {'itens': itens, 'fracao': round(itens / total_itens, 4)}
+            for opcao, itens in temperar.items()
+        },
+    }
+
+def _inserir_pedidos(conn, pedidos):
+    """INSERT dos pedidos e, num executemany só, de todos os itens, dentro de uma transação já aberta; retorna os ids"""
+    criado_em = datetime.now(timezone.utc).replace(tzinfo=None)
+    ids, linhas_itens = [], []
+    for p in pedidos:
+        pedido_id = conn.execute('''
+            INSERT INTO pedidos (cliente, telefone, retirar_as, criado_em, prazo)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (p['cliente'], p['telefone'], p['retirar_as'], _formatar_timestamp(criado_em),
+              calcular_prazo(p['retirar_as'], criado_em))).lastrowid
+        ids.append(pedido_id)
+        linhas_itens.extend(
+            (pedido_id, posicao, item.get('descricao', ''), item.get('corte'),
+             _valor_moido(item), item.get('temperar'), *interpretar_quantidade(item.get('descricao')))
+            for posicao, item in enumerate(p['itens'])
+        )
+    conn.executemany('''
+        INSERT INTO pedido_itens (pedido_id, posicao, descricao, corte, moido, temperar, gramas, unidades)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', linhas_itens)
+    return ids
 
 def salvar_pedido(cliente, telefone, itens, retirar_as=None):
     """Salva novo pedido no banco"""
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    itens_json = json.dumps(itens)
-    c.execute('''
-        INSERT INTO pedidos (cliente, telefone, itens, retirar_as)
-        VALUES (?, ?, ?, ?)
-    ''', (cliente, telefone, itens_json, retirar_as))
-    conn.commit()
-    conn.close()
+    return salvar_pedidos([{'cliente': cliente, 'telefone': telefone, 'itens': itens, 'retirar_as': retirar_as}])[0]
+
+def salvar_pedidos(pedidos):
+    """Salva vários pedidos (dicts com cliente, telefone, itens, retirar_as) numa só transação; retorna os ids"""
+    with transacao() as conn:
+        ids = _inserir_pedidos(conn, pedidos)
+        _carimbar_fila(conn, *ids)
+    return ids
+
+def marcar_prontos(pedido_ids):
+    """Marca vários pedidos como prontos numa só transação; retorna o conjunto dos que estavam pendentes"""
+    if not pedido_ids:
+        return set()
+    marcadores = ', '.join('?' * len(pedido_ids))
+    with transacao() as conn:
+        marcados = {row['id'] for row in conn.execute(f'''
+            UPDATE pedidos SET status = 'pronto', pronto_em = CURRENT_TIMESTAMP, versao = versao + 1
+            WHERE id IN ({marcadores}) AND status = 'pendente'
+            RETURNING id
+        ''', list(pedido_ids))}
+        if marcados:
+            _carimbar_fila(conn, *marcados)
+    return marcados
 
 def marcar_pronto(pedido_id):
     """Marca pedido como pronto"""
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('UPDATE pedidos SET status = "pronto" WHERE id = ?', (pedido_id,))
-    conn.commit()
-    conn.close()
-
-def cancelar_item_pedido(pedido_id, item_index):
-    """Remove um item específico do pedido"""
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('SELECT itens FROM pedidos WHERE id = ?', (pedido_id,))
-    resultado = c.fetchone()
-    
-    if resultado:
-        itens = json.loads(resultado[0])
-        if 0 <= item_index < len(itens):
-            itens.pop(item_index)
-        if len(itens) == 0:
-            c.execute('UPDATE pedidos SET status = "pronto" WHERE id = ?', (pedido_id,))
-        else:
-            itens_json = json.dumps(itens)
-            c.execute('UPDATE pedidos SET itens = ? WHERE id = ?', (itens_json, pedido_id))
-        conn.commit()
-    conn.close()
-
-def modificar_item_pedido(pedido_id, item_index, novo_item):
-    """Modifica um item específico do pedido e marca como modificado"""
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('SELECT itens FROM pedidos WHERE id = ?', (pedido_id,))
-    resultado = c.fetchone()
-    
-    if resultado:
-        itens = json.loads(resultado[0])
-        if 0 <= item_index < len(itens):
-            itens[item_index] = novo_item
-            itens_json = json.dumps(itens)
-            c.execute('''
-                UPDATE pedidos 
-                SET itens = ?, modificado = 1 
-                WHERE id = ?
-            ''', (itens_json, pedido_id))
-            conn.commit()
-    conn.close()
+    return pedido_id in marcar_prontos([pedido_id])
+
+def item_id_por_posicao(pedido_id, item_index):
+    """Traduz a posição de um item na lista exibida (itens não cancelados) para o id dele"""
+    with conexao() as conn:
+        row = conn.execute('''
+            SELECT id FROM pedido_itens
+            WHERE pedido_id = ? AND cancelado = 0
+            ORDER BY posicao LIMIT 1 OFFSET ?
+        ''', (pedido_id, item_index)).fetchone()
+    return row['id'] if row else None
+
+def _avancar_versao(conn, pedido_id, versao_esperada):
+    """Compare-and-swap da versão de um pedido pendente; retorna a nova versão.
+
+    Sem versão esperada (clientes antigos) só exige que o pedido ainda esteja pendente.
+    """
+    row = conn.execute('''
+        UPDATE pedidos SET versao = versao + 1
+        WHERE id = ? AND status = 'pendente' AND (?2 IS NULL OR versao = ?2)
+        RETURNING versao
+    ''', (pedido_id, versao_esperada)).fetchone()
+    if row is None:
+        raise ConflitoVersao(pedido_id)
+    return row['versao']
+
+def cancelar_item_pedido(pedido_id, item_id, versao=None):
+    """Cancela um item do pedido (que sai da fila se ficar sem itens) e retorna a nova versão"""
+    with transacao() as conn:
+        nova_versao = _avancar_versao(conn, pedido_id, versao)
+        cursor = conn.execute('''
+            UPDATE pedido_itens SET cancelado = 1
+            WHERE id = ? AND pedido_id = ? AND cancelado = 0
+        ''', (item_id, pedido_id))
+        if cursor.rowcount == 0:
+            raise ConflitoVersao(pedido_id)
+
+        restantes = conn.execute('''
+            SELECT 1 FROM pedido_itens WHERE pedido_id = ? AND cancelado = 0 LIMIT 1
+        ''', (pedido_id,)).fetchone()
+        if not restantes:
+            conn.execute("UPDATE pedidos SET status = 'pronto', pronto_em = CURRENT_TIMESTAMP WHERE id = ?",
+                         (pedido_id,))
+        _carimbar_fila(conn, pedido_id)
+
+    return nova_versao
+
+def modificar_item_pedido(pedido_id, item_id, novo_item, versao=None):
+    """Modifica um item do pedido, marca o pedido como modificado e retorna a nova versão"""
+    with transacao() as conn:
+        nova_versao = _avancar_versao(conn, pedido_id, versao)
+        cursor = conn.execute('''
+            UPDATE pedido_itens
+            SET descricao = ?, corte = ?, moido = ?, temperar = ?, gramas = ?, unidades = ?
+            WHERE id = ? AND pedido_id = ? AND cancelado = 0
+        ''', (novo_item.get('descricao', ''), novo_item.get('corte'), _valor_moido(novo_item),
+              novo_item.get('temperar'), *interpretar_quantidade(novo_item.get('descricao')),
+              item_id, pedido_id))
+        if cursor.rowcount == 0:
+            raise ConflitoVersao(pedido_id)
+
+        conn.execute('UPDATE pedidos SET modificado = 1 WHERE id = ?', (pedido_id,))
+        _carimbar_fila(conn, pedido_id)
+
+    return nova_versao
+
+# Idempotência
+# Clientes que podem repetir uma escrita (Wi-Fi caiu, timeout) mandam uma chave;
+# a resposta da primeira vez fica guardada por IDEMPOTENCIA_HORAS e é devolvida
+# de novo às repetições, sem executar a escrita outra vez.
+IDEMPOTENCIA_HORAS = 24
+IDEMPOTENCIA_CHAVE_MAX = 200
+
+def resultado_idempotente(conn, chave):
+    """Linha (rota, status, resposta) já guardada para a chave, ou None se não há (ou expirou)"""
+    return conn.execute('''
+        SELECT rota, status, resposta FROM idempotencia
+        WHERE chave = ? AND criado_em >= datetime('now', ?)
+    ''', (chave, f'-{IDEMPOTENCIA_HORAS} hours')).fetchone()
+
+def guardar_idempotente(conn, chave, rota, status, resposta):
+    """Guarda a resposta dada para a chave (na mesma transação da escrita que ela protege)"""
+    conn.execute('''
+        INSERT OR REPLACE INTO idempotencia (chave, rota, status, resposta)
+        VALUES (?, ?, ?, ?)
+    ''', (chave, rota, status, resposta))
+
+def limpar_idempotencia():
+    """Apaga as chaves vencidas; retorna quantas"""
+    with transacao() as conn:
+        return conn.execute('''
+            DELETE FROM idempotencia WHERE criado_em < datetime('now', ?)
+        ''', (f'-{IDEMPOTENCIA_HORAS} hours',)).rowcount
+
+# Arquivamento
+# Pedidos prontos há mais de ARQUIVAR_APOS_DIAS saem de pedidos/pedido_itens para
+# pedidos_arquivo/pedido_itens_arquivo, em lotes pequenos (cada um numa transação
+# curta, para não segurar o lock de escrita enquanto a loja grava pedidos). Assim
+# as tabelas vivas ficam do tamanho do movimento e o histórico continua no banco.
+ARQUIVAR_APOS_DIAS = int(os.environ.get('PEDIDOS_ARQUIVAR_DIAS', 30))
+ARQUIVO_LOTE = 200
+ARQUIVO_PAUSA_S = 0.2
+ARQUIVO_INTERVALO_S = 15 * 60
+
+_COLUNAS_PEDIDO_ARQUIVO = ('id, cliente, telefone, criado_em, status, retirar_as, prazo, modificado, versao, '
+                           'versao_fila, pronto_em')
+_COLUNAS_ITEM_ARQUIVO = 'id, pedido_id, posicao, descricao, corte, moido, temperar, cancelado, gramas, unidades'
+
+def arquivar_lote(dias=None, limite=ARQUIVO_LOTE):
+    """Move um lote de pedidos prontos mais velhos que `dias` para o arquivo; retorna quantos moveu"""
+    dias = ARQUIVAR_APOS_DIAS if dias is None else dias
+    with transacao() as conn:
+        ids = [row[0] for row in conn.execute('''
+            SELECT id FROM pedidos
+            WHERE status = 'pronto' AND pronto_em < datetime('now', ?)
+            ORDER BY pronto_em
+            LIMIT ?
+        ''', (f'-{dias} days', limite))]
+        if not ids:
+            return 0
+
+        marcadores = ','.join('?' * len(ids))
+        conn.execute(f'''
+            INSERT INTO pedidos_arquivo ({_COLUNAS_PEDIDO_ARQUIVO})
+            SELECT {_COLUNAS_PEDIDO_ARQUIVO} FROM pedidos WHERE id IN ({marcadores})
+        ''', ids)
+        conn.execute(f'''
+            INSERT INTO pedido_itens_arquivo ({_COLUNAS_ITEM_ARQUIVO})
+            SELECT {_COLUNAS_ITEM_ARQUIVO} FROM pedido_itens WHERE pedido_id IN ({marcadores})
+        ''', ids)
+        conn.execute(f'DELETE FROM pedido_itens WHERE pedido_id IN ({marcadores})', ids)
+        conn.execute(f'DELETE FROM pedidos WHERE id IN ({marcadores})', ids)
+    return len(ids)
+
+def arquivar_antigos(dias=None):
+    """Arquiva lote a lote até não sobrar pedido elegível; retorna o total movido"""
+    total = 0
+    while True:
+        movidos = arquivar_lote(dias)
+        total += movidos
+        if movidos < ARQUIVO_LOTE:
+            return total
+        time.sleep(ARQUIVO_PAUSA_S)
+
+_arquivador = {'pid': None}
+_arquivador_lock = threading.Lock()
+
+def _arquivar_periodicamente():
+    """Laço da thread de arquivamento (que também limpa as chaves de idempotência vencidas)"""
+    while True:
+        try:
+            total = arquivar_antigos()
+            if total:
+                app.logger.info('Arquivados %d pedidos prontos', total)
+            limpar_idempotencia()
+        except sqlite3.Error as erro:
+            app.logger.warning('Arquivamento: %s', erro)
+        time.sleep(ARQUIVO_INTERVALO_S)
+
+def _garantir_arquivador():
+    """Sobe a thread de arquivamento deste processo"""
+    # Com vários workers cada um roda a sua; os lotes são transações IMMEDIATE e
+    # escolhem os ids já dentro delas, então não se atropelam
+    if _arquivador['pid'] == os.getpid():
+        return
+    with _arquivador_lock:
+        if _arquivador['pid'] == os.getpid():
+            return
+        threading.Thread(target=_arquivar_periodicamente, name='arquivador', daemon=True).start()
+        _arquivador['pid'] = os.getpid()
 
 # Templates HTML
 
 TEMPLATE_OPERADOR = '''
+{#- Campos de um item do pedido; o primeiro vem pronto na página e os outros saem do <template id="modeloItem"> -#}
+{% macro campos_item(i) %}
+                    <div class="form-group">
+                        <label for="descricao-{{ i }}" class="required">Quantidade</label>
+                        <input type="text" id="descricao-{{ i }}" name="descricao-{{ i }}" placeholder="Ex: 1kg, 500g, 2 unidades">
+                    </div>
+                    
+                    <div class="form-group">
+                        <label class="required">Tipo de corte</label>
+                        <div class="cortes-group">
+                            {%- for corte in cortes %}
+                            <button type="button" class="corte-btn" data-corte="{{ corte }}" onclick="selecionarCorte(this, {{ i }})">{{ corte }}</button>
+                            {%- endfor %}
+                        </div>
+                        <input type="hidden" id="corte-{{ i }}" name="corte-{{ i }}" value="">
+                    </div>
+                    
+                    <div class="moido-input" id="moido-container-{{ i }}">
+                        <div class="form-group">
+                            <label for="moido-{{ i }}" class="required">Quantas vezes moído?</label>
+                            <input type="number" id="moido-{{ i }}" name="moido-{{ i }}" min="1" max="10" placeholder="Ex: 2">
+                        </div>
+                    </div>
+                    
+                    <div class="form-group">
+                        <label class="required">Temperar?</label>
+                        <div class="temperar-group">
+                            {%- for valor, rotulo in temperos %}
+                            <button type="button" class="temperar-btn" data-temperar="{{ valor }}" onclick="selecionarTemperar(this, {{ i }})">{{ rotulo }}</button>
+                            {%- endfor %}
+                        </div>
+                        <input type="hidden" id="temperar-{{ i }}" name="temperar-{{ i }}" value="">
+                    </div>
+                    
+                    <hr style="margin: 16px 0; border: none; border-top: 1px solid #e0e0e0;">
+{%- endmacro %}
 <!DOCTYPE html>
 <html lang="pt-BR">
 <head>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Operador - Casa de Carnes Bom Sabor</title>
-    <style>
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
-        
-        body {
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', sans-serif;
-            background: #111111;
-            min-height: 100vh;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            padding: 20px;
-        }
-        
-        .container {
-            background: #ffffff;
-            border-radius: 12px;
-            box-shadow: 0 20px 60px rgba(0, 0, 0, 0.6);
-            padding: 32px 32px 16px 32px;
-            max-width: 640px;
-            width: 100%;
-            max-height: 90vh;
-            overflow-y: auto;
-        }
-        
-        h1 {
-            color: #b00020;
-            margin-bottom: 16px;
-            text-align: center;
-            font-size: 24px;
-            letter-spacing: 0.08em;
-            text-transform: uppercase;
-        }
-
-        .brand-header {
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            gap: 12px;
-            margin-bottom: 8px;
-        }
-
-        .brand-logo {
-            height: 56px;
-            width: auto;
-        }
-
-        .brand-text-main {
-            font-size: 20px;
-            font-weight: 700;
-            color: #222222;
-            letter-spacing: 1px;
-        }
-
-        .brand-text-sub {
-            font-size: 11px;
-            text-transform: uppercase;
-            color: #888888;
-        }
-
-        .divider {
-            height: 1px;
-            background: linear-gradient(90deg, transparent, #b00020, transparent);
-            margin: 12px 0 24px 0;
-        }
-        
-        .form-group {
-            margin-bottom: 18px;
-        }
-        
-        label {
-            display: block;
-            color: #444444;
-            font-weight: 600;
-            margin-bottom: 6px;
-            font-size: 13px;
-        }
-        
-        .required::after {
-            content: " *";
-            color: #b00020;
-        }
-        
-        input[type="text"],
-        input[type="tel"],
-        input[type="number"],
-        input[type="time"],
-        textarea {
-            width: 100%;
-            padding: 10px 11px;
-            border: 1px solid #dddddd;
-            border-radius: 8px;
-            font-size: 14px;
-            transition: border-color 0.2s, box-shadow 0.2s;
-            font-family: inherit;
-        }
-        
-        input[type="text"]:focus,
-        input[type="tel"]:focus,
-        input[type="number"]:focus,
-        input[type="time"]:focus,
-        textarea:focus {
-            outline: none;
-            border-color: #b00020;
-            box-shadow: 0 0 0 2px rgba(176, 0, 32, 0.15);
-        }
-        
-        textarea {
-            resize: vertical;
-            min-height: 60px;
-        }
-        
-        .cortes-group {
-            display: grid;
-            grid-template-columns: 1fr 1fr;
-            gap: 8px;
-            margin-top: 8px;
-        }
-        
-        .corte-btn {
-            padding: 8px;
-            border: 1px solid #e0e0e0;
-            background: #fafafa;
-            border-radius: 8px;
-            cursor: pointer;
-            font-size: 11px;
-            font-weight: 500;
-            transition: all 0.2s;
-            text-align: center;
-            color: #444444;
-        }
-        
-        .corte-btn:hover {
-            border-color: #b00020;
-            background: #fff5f7;
-        }
-        
-        .corte-btn.active {
-            background: #b00020;
-            color: white;
-            border-color: #b00020;
-        }
-        
-        .temperar-group {
-            display: flex;
-            gap: 8px;
-            margin-top: 8px;
-        }
-        
-        .temperar-btn {
-            flex: 1;
-            padding: 9px;
-            border: 1px solid #e0e0e0;
-            background: #fafafa;
-            border-radius: 8px;
-            cursor: pointer;
-            font-size: 13px;
-            font-weight: 600;
-            transition: all 0.2s;
-            color: #333333;
-        }
-        
-        .temperar-btn:hover {
-            border-color: #b00020;
-            background: #fff5f7;
-        }
-        
-        .temperar-btn.active {
-            background: #b00020;
-            color: white;
-            border-color: #b00020;
-        }
-        
-        .btn-remove-item {
-            position: absolute;
-            top: 8px;
-            right: 8px;
-            background: #b00020;
-            color: white;
-            border: none;
-            border-radius: 50%;
-            width: 26px;
-            height: 26px;
-            cursor: pointer;
-            font-size: 16px;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            transition: all 0.2s;
-        }
-        
-        .btn-remove-item:hover {
-            background: #8d001a;
-            transform: scale(1.05);
-        }
-        
-        .btn-add-item {
-            width: 100%;
-            padding: 11px;
-            background: #b00020;
-            color: white;
-            border: none;
-            border-radius: 8px;
-            font-size: 14px;
-            font-weight: 600;
-            cursor: pointer;
-            transition: all 0.2s;
-            margin: 12px 0 4px 0;
-        }
-        
-        .btn-add-item:hover {
-            background: #8d001a;
-            box-shadow: 0 8px 18px rgba(176, 0, 32, 0.35);
-        }
-        
-        .btn-submit {
-            width: 100%;
-            padding: 13px;
-            background: linear-gradient(135deg, #000000 0%, #b00020 100%);
-            color: white;
-            border: none;
-            border-radius: 8px;
-            font-size: 15px;
-            font-weight: 600;
-            cursor: pointer;
-            transition: transform 0.15s, box-shadow 0.15s;
-            margin-top: 12px;
-        }
-        
-        .btn-submit:hover {
-            transform: translateY(-1px);
-            box-shadow: 0 10px 24px rgba(0, 0, 0, 0.35);
-        }
-        
-        .success-message {
-            background: #d4edda;
-            color: #155724;
-            padding: 10px;
-            border-radius: 8px;
-            margin-bottom: 16px;
-            text-align: center;
-            display: none;
-            font-size: 13px;
-        }
-        
-        .error-message {
-            background: #f8d7da;
-            color: #721c24;
-            padding: 10px;
-            border-radius: 8px;
-            margin-bottom: 16px;
-            text-align: center;
-            display: none;
-            font-size: 13px;
-        }
-        
-        .moido-input {
-            margin-top: 8px;
-            display: none;
-        }
-        
-        .moido-input.show {
-            display: block;
-        }
-
-        .item-form {
-            position: relative;
-        }
-
-        .item-form.removivel .btn-remove-item {
-            display: flex;
-        }
-
-        .item-form:not(.removivel) .btn-remove-item {
-            display: none;
-        }
-
-        footer {
-            margin-top: 18px;
-            text-align: center;
-            font-size: 11px;
-            color: #777777;
-        }
-    </style>
+    <link rel="stylesheet" href="{{ asset('css/operador.css') }}">
 </head>
 <body>
     <div class="container">
         <div class="brand-header">
-            <img src="{{ url_for('static', filename='logo-bom-sabor.png') }}" alt="Casa de Carnes Bom Sabor" class="brand-logo">
+            <img src="{{ asset('logo-bom-sabor-56.png') }}" srcset="{{ asset('logo-bom-sabor-112.png') }} 2x, {{ asset('logo-bom-sabor-168.png') }} 3x" width="56" height="56" alt="Casa de Carnes Bom Sabor" class="brand-logo">
             <div>
                 <div class="brand-text-main">Casa de Carnes Bom Sabor</div>
                 <div class="brand-text-sub">Qualidade em cada corte</div>
@@ -446,52 +1502,7 @@ TEMPLATE_OPERADOR = '''
                 <div class="item-form" id="item-0">
                     <h3 style="margin-bottom: 12px; color: #333; font-size:15px;">Item #1</h3>
                     
-                    <div class="form-group">
-                        <label for="descricao-0" class="required">Quantidade</label>
-                        <input type="text" id="descricao-0" name="descricao-0" placeholder="Ex: 1kg, 500g, 2 unidades">
-                    </div>
-                    
-                    <div class="form-group">
-                        <label class="required">Tipo de corte</label>
-                        <div class="cortes-group">
-                            <button type="button" class="corte-btn" data-corte="Bife" onclick="selecionarCorte(this, 0)">Bife</button>
-                            <button type="button" class="corte-btn" data-corte="Bife fino" onclick="selecionarCorte(this, 0)">Bife fino</button>
-                            <button type="button" class="corte-btn" data-corte="Bife grosso" onclick="selecionarCorte(this, 0)">Bife grosso</button>
-                            <button type="button" class="corte-btn" data-corte="Grelha" onclick="selecionarCorte(this, 0)">Grelha</button>
-                            <button type="button" class="corte-btn" data-corte="Iscas" onclick="selecionarCorte(this, 0)">Iscas</button>
-                            <button type="button" class="corte-btn" data-corte="Cubos" onclick="selecionarCorte(this, 0)">Cubos</button>
-                            <button type="button" class="corte-btn" data-corte="Feijoada" onclick="selecionarCorte(this, 0)">Feijoada</button>
-                            <button type="button" class="corte-btn" data-corte="Inteiro" onclick="selecionarCorte(this, 0)">Inteiro</button>
-                            <button type="button" class="corte-btn" data-corte="Peça" onclick="selecionarCorte(this, 0)">Peça</button>
-                            <button type="button" class="corte-btn" data-corte="Medalhão" onclick="selecionarCorte(this, 0)">Medalhão</button>
-                            <button type="button" class="corte-btn" data-corte="Moído X vezes" onclick="selecionarCorte(this, 0)">Moído X vezes</button>
-                            <button type="button" class="corte-btn" data-corte="Para panela" onclick="selecionarCorte(this, 0)">Para panela</button>
-                            <button type="button" class="corte-btn" data-corte="Para picadinho" onclick="selecionarCorte(this, 0)">Para picadinho</button>
-                            <button type="button" class="corte-btn" data-corte="Para strogonoff" onclick="selecionarCorte(this, 0)">Para strogonoff</button>
-                            <button type="button" class="corte-btn" data-corte="Para espeto" onclick="selecionarCorte(this, 0)">Para espeto</button>
-                            <button type="button" class="corte-btn" data-corte="NAO IMPORTA" onclick="selecionarCorte(this, 0)">NAO IMPORTA</button>
-                        </div>
-                        <input type="hidden" id="corte-0" name="corte-0" value="">
-                    </div>
-                    
-                    <div class="moido-input" id="moido-container-0">
-                        <div class="form-group">
-                            <label for="moido-0" class="required">Quantas vezes moído?</label>
-                            <input type="number" id="moido-0" name="moido-0" min="1" max="10" placeholder="Ex: 2">
-                        </div>
-                    </div>
-                    
-                    <div class="form-group">
-                        <label class="required">Temperar?</label>
-                        <div class="temperar-group">
-                            <button type="button" class="temperar-btn" data-temperar="Sim" onclick="selecionarTemperar(this, 0)">Sim</button>
-                            <button type="button" class="temperar-btn" data-temperar="Não" onclick="selecionarTemperar(this, 0)">Não</button>
-                            <button type="button" class="temperar-btn" data-temperar="Não Importa" onclick="selecionarTemperar(this, 0)">Não importa</button>
-                        </div>
-                        <input type="hidden" id="temperar-0" name="temperar-0" value="">
-                    </div>
-                    
-                    <hr style="margin: 16px 0; border: none; border-top: 1px solid #e0e0e0;">
+                    {{ campos_item(0) }}
                 </div>
             </div>
             
@@ -499,232 +1510,28 @@ TEMPLATE_OPERADOR = '''
             
             <button type="submit" class="btn-submit">Confirmar pedido</button>
         </form>
+        
+        <div class="envios" id="envios">
+            <div class="envios-resumo" id="enviosResumo"></div>
+            <ul class="envios-lista" id="enviosLista"></ul>
+            <div class="envios-acoes" id="enviosAcoes">
+                <button type="button" onclick="reenviarRecusados()">Reenviar recusados</button>
+                <button type="button" onclick="descartarRecusados()">Descartar recusados</button>
+            </div>
+        </div>
 
         <footer>
-            Casa de Carnes Bom Sabor · Sistema de Pedidos
+            Casa de Carnes Bom Sabor · Sistema de Pedidos · <a href="/historico">Histórico de pedidos</a>
         </footer>
     </div>
     
-    <script>
-        let itemCount = 1;
-        
-        function selecionarCorte(btn, itemIndex) {
-            event.preventDefault();
-            const corte = btn.getAttribute('data-corte');
-            const botoesDesse = document.querySelectorAll(`#item-${itemIndex} .corte-btn`);
-            
-            if (btn.classList.contains('active')) {
-                btn.classList.remove('active');
-                document.getElementById(`corte-${itemIndex}`).value = '';
-                
-                const moidoContainer = document.getElementById(`moido-container-${itemIndex}`);
-                moidoContainer.classList.remove('show');
-                const moidoInput = document.getElementById(`moido-${itemIndex}`);
-                if (moidoInput) moidoInput.required = false;
-            } else {
-                botoesDesse.forEach(b => b.classList.remove('active'));
-                
-                btn.classList.add('active');
-                document.getElementById(`corte-${itemIndex}`).value = corte;
-                
-                const moidoContainer = document.getElementById(`moido-container-${itemIndex}`);
-                const moidoInput = document.getElementById(`moido-${itemIndex}`);
-                if (corte === "Moído X vezes") {
-                    moidoContainer.classList.add('show');
-                    if (moidoInput) moidoInput.required = true;
-                } else {
-                    moidoContainer.classList.remove('show');
-                    if (moidoInput) moidoInput.required = false;
-                }
-            }
-        }
-        
-        function selecionarTemperar(btn, itemIndex) {
-            event.preventDefault();
-            const temperar = btn.getAttribute('data-temperar');
-            const botoesDesse = document.querySelectorAll(`#item-${itemIndex} .temperar-btn`);
-            
-            if (btn.classList.contains('active')) {
-                btn.classList.remove('active');
-                document.getElementById(`temperar-${itemIndex}`).value = '';
-            } else {
-                botoesDesse.forEach(b => b.classList.remove('active'));
-                btn.classList.add('active');
-                document.getElementById(`temperar-${itemIndex}`).value = temperar;
-            }
-        }
-        
-        function adicionarItem() {
-            event.preventDefault();
-            
-            const container = document.getElementById('itensContainer');
-            const novoItem = document.createElement('div');
-            novoItem.className = 'item-form removivel';
-            novoItem.id = `item-${itemCount}`;
-            
-            novoItem.innerHTML = `
-                <h3 style="margin-bottom: 12px; color: #333; font-size:15px;">Item #${itemCount + 1}</h3>
-                <button type="button" class="btn-remove-item" onclick="removerItem(${itemCount})" title="Cancelar este item">✕</button>
-                
-                <div class="form-group">
-                    <label for="descricao-${itemCount}" class="required">Quantidade</label>
-                    <input type="text" id="descricao-${itemCount}" name="descricao-${itemCount}" placeholder="Ex: 1kg, 500g, 2 unidades">
-                </div>
-                
-                <div class="form-group">
-                    <label class="required">Tipo de corte</label>
-                    <div class="cortes-group">
-                        <button type="button" class="corte-btn" data-corte="Bife" onclick="selecionarCorte(this, ${itemCount})">Bife</button>
-                        <button type="button" class="corte-btn" data-corte="Bife fino" onclick="selecionarCorte(this, ${itemCount})">Bife fino</button>
-                        <button type="button" class="corte-btn" data-corte="Bife grosso" onclick="selecionarCorte(this, ${itemCount})">Bife grosso</button>
-                        <button type="button" class="corte-btn" data-corte="Grelha" onclick="selecionarCorte(this, ${itemCount})">Grelha</button>
-                        <button type="button" class="corte-btn" data-corte="Iscas" onclick="selecionarCorte(this, ${itemCount})">Iscas</button>
-                        <button type="button" class="corte-btn" data-corte="Cubos" onclick="selecionarCorte(this, ${itemCount})">Cubos</button>
-                        <button type="button" class="corte-btn" data-corte="Feijoada" onclick="selecionarCorte(this, ${itemCount})">Feijoada</button>
-                        <button type="button" class="corte-btn" data-corte="Inteiro" onclick="selecionarCorte(this, ${itemCount})">Inteiro</button>
-                        <button type="button" class="corte-btn" data-corte="Peça" onclick="selecionarCorte(this, ${itemCount})">Peça</button>
-                        <button type="button" class="corte-btn" data-corte="Medalhão" onclick="selecionarCorte(this, ${itemCount})">Medalhão</button>
-                        <button type="button" class="corte-btn" data-corte="Moído X vezes" onclick="selecionarCorte(this, ${itemCount})">Moído X vezes</button>
-                        <button type="button" class="corte-btn" data-corte="Para panela" onclick="selecionarCorte(this, ${itemCount})">Para panela</button>
-                        <button type="button" class="corte-btn" data-corte="Para picadinho" onclick="selecionarCorte(this, ${itemCount})">Para picadinho</button>
-                        <button type="button" class="corte-btn" data-corte="Para strogonoff" onclick="selecionarCorte(this, ${itemCount})">Para strogonoff</button>
-                        <button type="button" class="corte-btn" data-corte="Para espeto" onclick="selecionarCorte(this, ${itemCount})">Para espeto</button>
-                        <button type="button" class="corte-btn" data-corte="NAO IMPORTA" onclick="selecionarCorte(this, ${itemCount})">NAO IMPORTA</button>
-                    </div>
-                    <input type="hidden" id="corte-${itemCount}" name="corte-${itemCount}" value="">
-                </div>
-                
-                <div class="moido-input" id="moido-container-${itemCount}">
-                    <div class="form-group">
-                        <label for="moido-${itemCount}" class="required">Quantas vezes moído?</label>
-                        <input type="number" id="moido-${itemCount}" name="moido-${itemCount}" min="1" max="10" placeholder="Ex: 2">
-                    </div>
-                </div>
-                
-                <div class="form-group">
-                    <label class="required">Temperar?</label>
-                    <div class="temperar-group">
-                        <button type="button" class="temperar-btn" data-temperar="Sim" onclick="selecionarTemperar(this, ${itemCount})">Sim</button>
-                        <button type="button" class="temperar-btn" data-temperar="Não" onclick="selecionarTemperar(this, ${itemCount})">Não</button>
-                        <button type="button" class="temperar-btn" data-temperar="Não Importa" onclick="selecionarTemperar(this, ${itemCount})">Não importa</button>
-                    </div>
-                    <input type="hidden" id="temperar-${itemCount}" name="temperar-${itemCount}" value="">
-                </div>
-                
-                <hr style="margin: 16px 0; border: none; border-top: 1px solid #e0e0e0;">
-            `;
-            
-            container.appendChild(novoItem);
-            itemCount++;
-        }
-        
-        function removerItem(index) {
-            event.preventDefault();
-            const el = document.getElementById(`item-${index}`);
-            if (el) el.remove();
-        }
-        
-        function submitPedido(event) {
-            event.preventDefault();
-            
-            const cliente = document.getElementById('cliente').value.trim();
-            const telefone = document.getElementById('telefone').value.trim();
-            const retirarAs = document.getElementById('retirar_as').value;
-            
-            if (!cliente) {
-                showError('Nome do cliente é obrigatório!');
-                return;
-            }
-            
-            const itens = [];
-            for (let i = 0; i < itemCount; i++) {
-                const descricao = document.getElementById(`descricao-${i}`);
-                const corte = document.getElementById(`corte-${i}`);
-                const temperar = document.getElementById(`temperar-${i}`);
-                
-                if (descricao && descricao.value && descricao.value.trim()) {
-                    if (!corte.value || !temperar.value) {
-                        showError(`Item #${i + 1}: preencha o corte e se deve temperar.`);
-                        return;
-                    }
-                    
-                    const item = {
-                        descricao: descricao.value.trim(),
-                        corte: corte.value,
-                        temperar: temperar.value
-                    };
-                    
-                    if (corte.value === "Moído X vezes") {
-                        const moidoInput = document.getElementById(`moido-${i}`);
-                        const moido = moidoInput ? moidoInput.value : '';
-                        if (!moido) {
-                            showError(`Item #${i + 1}: informe quantas vezes moído.`);
-                            return;
-                        }
-                        item.moido = moido;
-                    }
-                    
-                    itens.push(item);
-                }
-            }
-            
-            if (itens.length === 0) {
-                showError('Adicione pelo menos um item com quantidade.');
-                return;
-            }
-            
-            fetch('/api/novo-pedido', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify({
-                    cliente: cliente,
-                    telefone: telefone,
-                    retirar_as: retirarAs,
-                    itens: itens
-                })
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.sucesso) {
-                    showSuccess('Pedido enviado com sucesso!');
-                    
-                    document.getElementById('formPedido').reset();
-                    
-                    for (let i = 1; i < itemCount; i++) {
-                        const item = document.getElementById(`item-${i}`);
-                        if (item) item.remove();
-                    }
-                    itemCount = 1;
-                    
-                    setTimeout(() => {
-                        document.getElementById('successMsg').style.display = 'none';
-                    }, 2500);
-                } else {
-                    showError('Erro ao salvar pedido.');
-                }
-            })
-            .catch(error => {
-                showError('Erro na conexão.');
-            });
-        }
-        
-        function showSuccess(msg) {
-            const msgDiv = document.getElementById('successMsg');
-            msgDiv.textContent = msg;
-            msgDiv.style.display = 'block';
-        }
-        
-        function showError(msg) {
-            const msgDiv = document.getElementById('errorMsg');
-            msgDiv.textContent = msg;
-            msgDiv.style.display = 'block';
-            setTimeout(() => {
-                msgDiv.style.display = 'none';
-            }, 5000);
-        }
-    </script>
+    <template id="modeloItem">
+                    <h3 style="margin-bottom: 12px; color: #333; font-size:15px;">Item #__numero__</h3>
+                    <button type="button" class="btn-remove-item" onclick="removerItem(__i__)" title="Cancelar este item">✕</button>
+                    {{ campos_item('__i__') }}
+    </template>
+    
+    <script src="{{ asset('js/operador.js') }}"></script>
 </body>
 </html>
 '''
@@ -736,523 +1543,12 @@ TEMPLATE_PRODUCAO = '''
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Produção - Casa de Carnes Bom Sabor</title>
-    <style>
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
-        
-        body {
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', sans-serif;
-            background: radial-gradient(circle at top, #b00020 0%, #000000 55%, #000000 100%);
-            min-height: 100vh;
-            padding: 20px;
-        }
-        
-        .container {
-            max-width: 1400px;
-            margin: 0 auto;
-        }
-        
-        .brand-header {
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            gap: 12px;
-            margin-bottom: 6px;
-        }
-
-        .brand-logo {
-            height: 56px;
-            width: auto;
-        }
-
-        .brand-text-main {
-            font-size: 22px;
-            font-weight: 700;
-            color: #ffffff;
-            letter-spacing: 1px;
-        }
-
-        .brand-text-sub {
-            font-size: 11px;
-            text-transform: uppercase;
-            color: #f3cfd6;
-        }
-
-        .divider {
-            height: 1px;
-            background: linear-gradient(90deg, transparent, #ffffff, transparent);
-            margin: 10px 0 18px 0;
-        }
-
-        h1 {
-            color: #ffffff;
-            margin-bottom: 18px;
-            text-align: center;
-            font-size: 24px;
-            text-transform: uppercase;
-            letter-spacing: 0.12em;
-        }
-        
-        .grid-pedidos {
-            display: grid;
-            grid-template-columns: repeat(3, minmax(0, 1fr));
-            gap: 18px;
-            margin-bottom: 18px;
-        }
-        
-        .pedido-card {
-            background: #ffffff;
-            border-radius: 12px;
-            padding: 22px;
-            box-shadow: 0 12px 30px rgba(0, 0, 0, 0.35);
-            animation: slideIn 0.3s ease-out;
-            border-left: 8px solid #b00020;
-            display: flex;
-            flex-direction: column;
-            justify-content: space-between;
-            min-height: 320px;
-        }
-        
-        @keyframes slideIn {
-            from {
-                opacity: 0;
-                transform: translateX(-18px);
-            }
-            to {
-                opacity: 1;
-                transform: translateX(0);
-            }
-        }
-        
-        .pedido-info {
-            flex: 1;
-        }
-        
-        .pedido-cliente {
-            font-size: 20px;
-            font-weight: 700;
-            color: #222222;
-            margin-bottom: 4px;
-        }
-        
-        .pedido-telefone {
-            font-size: 13px;
-            color: #777777;
-            margin-bottom: 4px;
-        }
-
-        .pedido-retirada {
-            font-size: 13px;
-            font-weight: 700;
-            color: #b00020;
-            margin-bottom: 8px;
-            background: #fff5f7;
-            border-radius: 6px;
-            padding: 4px 8px;
-            display: inline-block;
-            text-transform: uppercase;
-            letter-spacing: 0.05em;
-        }
-        
-        .item-list {
-            margin-bottom: 14px;
-        }
-        
-        .item-list h4 {
-            font-size: 11px;
-            color: #999999;
-            text-transform: uppercase;
-            margin-bottom: 8px;
-            letter-spacing: 0.12em;
-        }
-        
-        .item {
-            background: #fafafa;
-            padding: 11px 11px 11px 11px;
-            border-radius: 8px;
-            margin-bottom: 8px;
-            font-size: 13px;
-            position: relative;
-            padding-right: 40px;
-            border: 1px solid #eeeeee;
-        }
-        
-        .item-descricao {
-            font-weight: 600;
-            color: #333333;
-            margin-bottom: 4px;
-        }
-        
-        .item-corte {
-            font-size: 12px;
-            color: #555555;
-            margin-bottom: 2px;
-        }
-        
-        .item-temperar {
-            display: inline-block;
-            font-size: 13px;
-            font-weight: 700;
-            padding: 6px 14px;
-            border-radius: 999px;
-            margin-top: 6px;
-            text-transform: uppercase;
-            letter-spacing: 0.06em;
-        }
-        
-        .item-temperar.sim {
-            background: #b00020;
-            color: #ffffff;
-            border: 1px solid #7d0016;
-        }
-        
-        .item-temperar.nao {
-            background: #12b981;
-            color: #ffffff;
-            border: 1px solid #0f8f64;
-        }
-        
-        .item-temperar.nao-importa {
-            background: #e5e7eb;
-            color: #111827;
-            border: 1px solid #d1d5db;
-        }
-        
-        .btn-cancelar-item {
-            position: absolute;
-            right: 8px;
-            top: 8px;
-            background: #b00020;
-            color: white;
-            border: none;
-            border-radius: 50%;
-            width: 22px;
-            height: 22px;
-            cursor: pointer;
-            font-size: 14px;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            transition: all 0.2s;
-            padding: 0;
-            line-height: 1;
-        }
-        
-        .btn-cancelar-item:hover {
-            background: #8d001a;
-            transform: scale(1.05);
-        }
-        
-        .pedido-tempo {
-            font-size: 12px;
-            color: #999999;
-            margin-bottom: 14px;
-            padding-top: 8px;
-            border-top: 1px solid #eeeeee;
-        }
-        
-        .btn-pronto {
-            background: linear-gradient(135deg, #000000 0%, #b00020 100%);
-            color: white;
-            border: none;
-            padding: 12px;
-            border-radius: 8px;
-            font-size: 15px;
-            font-weight: 600;
-            cursor: pointer;
-            transition: all 0.2s;
-            width: 100%;
-        }
-        
-        .btn-pronto:hover {
-            transform: scale(1.02);
-            box-shadow: 0 8px 20px rgba(0, 0, 0, 0.45);
-        }
-        
-        .btn-pronto:active {
-            transform: scale(0.99);
-        }
-        
-        .vazio {
-            background: rgba(255, 255, 255, 0.06);
-            border-radius: 12px;
-            padding: 50px 20px;
-            text-align: center;
-            color: #f0f0f0;
-            font-size: 17px;
-            grid-column: 1 / -1;
-            border: 1px solid rgba(255, 255, 255, 0.18);
-        }
-        
-        .vazio-emoji {
-            font-size: 40px;
-            margin-bottom: 12px;
-        }
-        
-        .link-operador {
-            text-align: center;
-            margin-top: 18px;
-        }
-        
-        .link-operador a {
-            color: #ffe6eb;
-            text-decoration: none;
-            font-weight: 600;
-            font-size: 14px;
-        }
-        
-        .link-operador a:hover {
-            text-decoration: underline;
-        }
-        
-        .info-refresh {
-            text-align: center;
-            color: #f5d7de;
-            font-size: 11px;
-            margin-top: 8px;
-            opacity: 0.8;
-        }
-
-        footer {
-            margin-top: 18px;
-            text-align: center;
-            font-size: 11px;
-            color: #f0cdd5;
-        }
-
-        .btn-editar-pedido {
-            position: absolute;
-            top: 12px;
-            right: 12px;
-            background: #fbbf24;
-            color: #000000;
-            border: none;
-            padding: 8px 14px;
-            border-radius: 8px;
-            font-size: 12px;
-            font-weight: 700;
-            cursor: pointer;
-            transition: all 0.2s;
-            display: flex;
-            align-items: center;
-            gap: 4px;
-            box-shadow: 0 2px 8px rgba(251, 191, 36, 0.35);
-        }
-        .btn-editar-pedido:hover {
-            background: #f59e0b;
-            transform: translateY(-1px);
-            box-shadow: 0 4px 12px rgba(251, 191, 36, 0.45);
-        }
-        
-        .pedido-card {
-            position: relative; /* Garante que o botão absolute funcione */
-        }
-
-        .pedido-modificado {
-            background: #fef3c7;
-            border-left: 8px solid #f59e0b !important;
-            border: 2px solid #fbbf24;
-        }
-
-        .alerta-modificado {
-            background: #fef3c7;
-            color: #92400e;
-            padding: 8px 12px;
-            border-radius: 8px;
-            font-size: 12px;
-            font-weight: 700;
-            margin-bottom: 12px;
-            text-align: center;
-            border: 1px solid #fbbf24;
-
-        .modal-overlay {
-            display: none;
-            position: fixed;
-            top: 0;
-            left: 0;
-            width: 100%;
-            height: 100%;
-            background: rgba(0, 0, 0, 0.75);
-            z-index: 1000;
-            justify-content: center;
-            align-items: center;
-            padding: 20px;
-}
-
-        .modal-overlay.show {
-            display: flex;
-}
-
-        .modal-content {
-            background: #ffffff;
-            border-radius: 12px;
-            padding: 24px;
-            max-width: 600px;
-            width: 100%;
-            max-height: 85vh;
-            overflow-y: auto;
-            box-shadow: 0 20px 60px rgba(0, 0, 0, 0.5);
-}
-
-        .modal-header {
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-            margin-bottom: 20px;
-            padding-bottom: 12px;
-            border-bottom: 2px solid #eeeeee;
-}
-
-        .modal-header h2 {
-            color: #b00020;
-            margin: 0;
-            font-size: 20px;
-}
-
-        .btn-fechar-modal {
-            background: #666666;
-            color: white;
-            border: none;
-            border-radius: 50%;
-            width: 32px;
-            height: 32px;
-            cursor: pointer;
-            font-size: 20px;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            transition: all 0.2s;
-}
-
-        .btn-fechar-modal:hover {
-        background: #333333;
-        transform: scale(1.05);
-}
-
-.item-edicao {
-    background: #fafafa;
-    border: 1px solid #eeeeee;
-    border-radius: 8px;
-    padding: 16px;
-    margin-bottom: 16px;
-}
-
-.item-edicao h4 {
-    color: #333333;
-    margin: 0 0 12px 0;
-    font-size: 14px;
-}
-
-.form-group-modal {
-    margin-bottom: 12px;
-}
-
-.form-group-modal label {
-    display: block;
-    color: #444444;
-    font-weight: 600;
-    margin-bottom: 6px;
-    font-size: 12px;
-}
-
-.form-group-modal input {
-    width: 100%;
-    padding: 8px;
-    border: 1px solid #dddddd;
-    border-radius: 6px;
-    font-size: 13px;
-}
-
-.cortes-group-modal {
-    display: grid;
-    grid-template-columns: repeat(3, 1fr);
-    gap: 6px;
-    margin-top: 6px;
-}
-
-.corte-btn-modal {
-    padding: 6px;
-    border: 1px solid #e0e0e0;
-    background: #fafafa;
-    border-radius: 6px;
-    cursor: pointer;
-    font-size: 10px;
-    font-weight: 500;
-    transition: all 0.2s;
-    text-align: center;
-    color: #444444;
-}
-
-.corte-btn-modal:hover {
-    border-color: #b00020;
-    background: #fff5f7;
-}
-
-.corte-btn-modal.active {
-    background: #b00020;
-    color: white;
-    border-color: #b00020;
-}
-
-.temperar-group-modal {
-    display: flex;
-    gap: 6px;
-    margin-top: 6px;
-}
-
-.temperar-btn-modal {
-    flex: 1;
-    padding: 8px;
-    border: 1px solid #e0e0e0;
-    background: #fafafa;
-    border-radius: 6px;
-    cursor: pointer;
-    font-size: 12px;
-    font-weight: 600;
-    transition: all 0.2s;
-    color: #333333;
-}
-
-.temperar-btn-modal:hover {
-    border-color: #b00020;
-    background: #fff5f7;
-}
-
-.temperar-btn-modal.active {
-    background: #b00020;
-    color: white;
-    border-color: #b00020;
-}
-
-.btn-salvar-edicao {
-    width: 100%;
-    padding: 12px;
-    background: linear-gradient(135deg, #000000 0%, #b00020 100%);
-    color: white;
-    border: none;
-    border-radius: 8px;
-    font-size: 14px;
-    font-weight: 600;
-    cursor: pointer;
-    transition: all 0.2s;
-    margin-top: 8px;
-}
-
-.btn-salvar-edicao:hover {
-    transform: translateY(-1px);
-    box-shadow: 0 8px 20px rgba(0, 0, 0, 0.35);
-}
-        }
-
-    </style>
+    <link rel="stylesheet" href="{{ asset('css/producao.css') }}">
 </head>
-<body>
+<body data-em-risco-min="{{ em_risco_min }}">
     <div class="container">
         <div class="brand-header">
-            <img src="{{ url_for('static', filename='logo-bom-sabor.png') }}" alt="Casa de Carnes Bom Sabor" class="brand-logo">
+            <img src="{{ asset('logo-bom-sabor-56.png') }}" srcset="{{ asset('logo-bom-sabor-112.png') }} 2x, {{ asset('logo-bom-sabor-168.png') }} 3x" width="56" height="56" alt="Casa de Carnes Bom Sabor" class="brand-logo">
             <div>
                 <div class="brand-text-main">Casa de Carnes Bom Sabor</div>
                 <div class="brand-text-sub">Qualidade em cada corte</div>
@@ -1261,17 +1557,18 @@ TEMPLATE_PRODUCAO = '''
         <div class="divider"></div>
         <h1>Fila de Produção</h1>
         
-        <div class="grid-pedidos" id="fila">
-            <div class="vazio">
-                <div class="vazio-emoji">✓</div>
-                <div>Nenhum pedido no momento</div>
-            </div>
+        <div class="grid-pedidos" id="fila"></div>
+
+        <div class="vazio" id="vazio">
+            <div class="vazio-emoji">🍖</div>
+            <div>Nenhum pedido no momento</div>
         </div>
         
-        <div class="info-refresh">Atualiza automaticamente a cada 2 segundos</div>
+        <div class="info-refresh" id="infoRefresh">Atualiza automaticamente a cada 2 segundos</div>
         
         <div class="link-operador">
             <a href="/operador" target="_blank">Ir para tela do operador</a>
+            · <a href="/producao/lotes" target="_blank">Ver cortes agrupados</a>
         </div>
 
         <footer>
@@ -1279,219 +1576,995 @@ TEMPLATE_PRODUCAO = '''
         </footer>
     </div>
     
-    <script>
-        function formatarTempo(dataString) {
-            const data = new Date(dataString);
-            const agora = new Date();
-            const diff = Math.floor((agora - data) / 1000);
-            
-            if (diff < 60) return 'agora';
-            if (diff < 3600) return Math.floor(diff / 60) + 'min atrás';
-            return Math.floor(diff / 3600) + 'h atrás';
-        }
-        
-        function editarPedido(pedidoId) {
-    alert(`Editar pedido #${pedidoId} - Funcionalidade em desenvolvimento`);
-}
+    <script src="{{ asset('js/producao.js') }}"></script>
+</body>
+</html>
+'''
+
+TEMPLATE_LOTES = '''
+<!DOCTYPE html>
+<html lang="pt-BR">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Cortes agrupados - Casa de Carnes Bom Sabor</title>
+    <link rel="stylesheet" href="{{ asset('css/lotes.css') }}">
+</head>
+<body data-em-risco-min="{{ em_risco_min }}">
+    <div class="container">
+        <h1>Cortes agrupados</h1>
+        <div class="subtitulo">Itens iguais de todos os pedidos pendentes, para cortar de uma vez</div>
 
+        <div class="grid-lotes" id="lotes"></div>
+        <div class="vazio" id="vazio">Nenhum item pendente</div>
 
-        function carregarPedidos() {
-    fetch('/api/pedidos-pendentes')
-        .then(response => response.json())
-        .then(data => {
-            const filaDiv = document.getElementById('fila');
-            
-            if (data.pedidos.length === 0) {
-                filaDiv.innerHTML = `
-                    <div class="vazio">
-                        <div class="vazio-emoji">🍖</div>
-                        <div>Nenhum pedido no momento</div>
-                    </div>
-                `;
-                return;
-            }
-
-            filaDiv.innerHTML = data.pedidos.map(pedido => {
-                const itens = JSON.parse(pedido.itens);
-                
-                let itensHTML = '';
-                itens.forEach((item, idx) => {
-                    let tempeInfo = '';
-                    if (item.temperar === 'Sim') {
-                        tempeInfo = `<span class="item-temperar sim">Temperar</span>`;
-                    } else if (item.temperar === 'Não') {
-                        tempeInfo = `<span class="item-temperar nao">Sem tempero</span>`;
-                    } else {
-                        tempeInfo = `<span class="item-temperar nao-importa">Não importa</span>`;
-                    }
-
-                    let corteInfo = item.corte;
-                    if (item.corte === 'Moído X vezes' && item.moido) {
-                        corteInfo = `${item.corte} (${item.moido}x)`;
-                    }
-
-                    itensHTML += `
-                        <div class="item">
-                            <button class="btn-cancelar-item" onclick="cancelarItem(${pedido.id}, ${idx})" title="Cancelar item">×</button>
-                            <div style="margin-bottom:4px">${tempeInfo}</div>
-                            <div class="item-descricao">${item.descricao}</div>
-                            <div class="item-corte">Corte: ${corteInfo}</div>
-                        </div>
-                    `;
-                });
-
-                // Alerta de pedido modificado
-                let alertaModificado = '';
-                if (pedido.modificado === 1) {
-                    alertaModificado = '<div class="alerta-modificado">⚠️ Pedido foi modificado pelo operador</div>';
-                }
-
-                // Classe adicional se modificado
-                let classeModificado = pedido.modificado === 1 ? 'pedido-modificado' : '';
-
-                return `
-                    <div class="pedido-card ${classeModificado}">
-                        <button class="btn-editar-pedido" onclick="editarPedido(${pedido.id})">
-                            Editar pedido ✏️
-                        </button>
-                        
-                        <div class="pedido-info">
-                            ${alertaModificado}
-                            <div class="pedido-cliente">${pedido.cliente}</div>
-                            ${pedido.telefone ? `<div class="pedido-telefone">Telefone: ${pedido.telefone}</div>` : ''}
-                            ${pedido.retirar_as ? `<div class="pedido-retirada">Retirar às ${pedido.retirar_as}</div>` : ''}
-                            
-                            <div class="item-list">
-                                <h4>Itens</h4>
-                                ${itensHTML}
-                            </div>
-                        </div>
-                        
-                        <div class="pedido-tempo">#${pedido.id} • ${formatarTempo(pedido.criado_em)}</div>
-                        <button class="btn-pronto" onclick="marcarPronto(${pedido.id})">✓ Marcar como pronto</button>
-                    </div>
-                `;
-            }).join('');
-        });
-}
+        <div class="link-operador">
+            <a href="/producao">Voltar para a fila de produção</a>
+        </div>
+    </div>
 
-        
-        function marcarPronto(pedidoId) {
-            fetch('/api/marcar-pronto', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify({ id: pedidoId })
-            })
-            .then(response => response.json())
-            .then(data => {
-                carregarPedidos();
-            });
-        }
-        
-        function cancelarItem(pedidoId, itemIndex) {
-            fetch('/api/cancelar-item', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify({ pedido_id: pedidoId, item_index: itemIndex })
-            })
-            .then(response => response.json())
-            .then(data => {
-                carregarPedidos();
-            });
-        }
-        
-        carregarPedidos();
-        setInterval(carregarPedidos, 2000);
-    </script>
+    <script src="{{ asset('js/lotes.js') }}"></script>
+</body>
+</html>
+'''
+
+TEMPLATE_HISTORICO = '''
+<!DOCTYPE html>
+<html lang="pt-BR">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Histórico - Casa de Carnes Bom Sabor</title>
+    <link rel="stylesheet" href="{{ asset('css/historico.css') }}">
+</head>
+<body>
+    <div class="container">
+        <h1>Histórico de pedidos</h1>
+
+        <form class="filtros" id="filtros">
+            <div>
+                <label for="q">Cliente ou telefone</label>
+                <input type="search" id="q" name="q" placeholder="Ex.: Maria, 9999-1234">
+            </div>
+            <div>
+                <label for="de">De</label>
+                <input type="date" id="de" name="de">
+            </div>
+            <div>
+                <label for="ate">Até</label>
+                <input type="date" id="ate" name="ate">
+            </div>
+            <div>
+                <label for="status">Status</label>
+                <select id="status" name="status">
+                    <option value="">Todos</option>
+                    <option value="pendente">Pendente</option>
+                    <option value="pronto">Pronto</option>
+                </select>
+            </div>
+            <button type="submit">Buscar</button>
+        </form>
+
+        <div id="resultados"></div>
+        <button id="mais" type="button">Carregar mais</button>
+
+        <footer>
+            <a href="/operador">Voltar para a tela do operador</a>
+        </footer>
+    </div>
+
+    <script src="{{ asset('js/historico.js') }}"></script>
 </body>
 </html>
 '''
 
+# Opções do formulário do operador: um botão por corte e por escolha de tempero
+CORTES = [
+    'Bife', 'Bife fino', 'Bife grosso', 'Grelha', 'Iscas', 'Cubos', 'Feijoada', 'Inteiro',
+    'Peça', 'Medalhão', 'Moído X vezes', 'Para panela', 'Para picadinho', 'Para strogonoff',
+    'Para espeto', 'NAO IMPORTA',
+]
+TEMPEROS = [('Sim', 'Sim'), ('Não', 'Não'), ('Não Importa', 'Não importa')]
+
+# Templates compilados uma única vez; o HTML final também é renderizado uma vez por processo
+_TEMPLATES = {
+    'operador': app.jinja_env.from_string(TEMPLATE_OPERADOR),
+    'producao': app.jinja_env.from_string(TEMPLATE_PRODUCAO),
+    'lotes': app.jinja_env.from_string(TEMPLATE_LOTES),
+    'historico': app.jinja_env.from_string(TEMPLATE_HISTORICO),
+}
+
+# Por quanto tempo o navegador pode reutilizar uma página sem revalidar
+PAGINAS_MAX_AGE = 3600
+
+_paginas_prontas = {}
+
+def preparar_conteudo(corpo, comprimir=True):
+    """Empacota bytes prontos para servir: corpo, versões gzip/brotli e ETag pelo hash do conteúdo"""
+    conteudo = {
+        'corpo': corpo,
+        'etag': hashlib.sha256(corpo).hexdigest()[:20],
+    }
+    if comprimir:
+        conteudo['gzip'] = gzip.compress(corpo, compresslevel=9, mtime=0)
+        if brotli is not None:
+            conteudo['br'] = brotli.compress(corpo, quality=11)
+    return conteudo
+
+def _codificacao_aceita(conteudo):
+    """Melhor compressão pronta que o cliente aceita ('br', 'gzip' ou None)"""
+    for codificacao in ('br', 'gzip'):
+        if codificacao in conteudo and codificacao in request.accept_encodings:
+            return codificacao
+    return None
+
+def responder_conteudo(conteudo, mimetype, cache_control):
+    """Serve um conteúdo preparado, com 304 por ETag e compressão quando o cliente aceita"""
+    codificacao = _codificacao_aceita(conteudo)
+    if request.if_none_match.contains(conteudo['etag']):
+        resposta = Response(status=304)
+    elif codificacao:
+        resposta = Response(conteudo[codificacao], mimetype=mimetype)
+        resposta.headers['Content-Encoding'] = codificacao
+    else:
+        resposta = Response(conteudo['corpo'], mimetype=mimetype)
+    resposta.set_etag(conteudo['etag'])
+    resposta.headers['Cache-Control'] = cache_control
+    resposta.headers['Vary'] = 'Accept-Encoding'
+    return resposta
+
+def pagina(nome):
+    """Resposta de uma das páginas, renderizada só na primeira vez"""
+    pronta = _paginas_prontas.get(nome)
+    if pronta is None:
+        html = render_template(_TEMPLATES[nome], em_risco_min=EM_RISCO_MIN, cortes=CORTES, temperos=TEMPEROS)
+        pronta = preparar_conteudo(html.encode('utf-8'))
+        _paginas_prontas[nome] = pronta
+    return responder_conteudo(pronta, 'text/html', f'public, max-age={PAGINAS_MAX_AGE}')
+
+# Arquivos estáticos
+# CSS, JS e logos de static/ saem em /assets/ com o hash do conteúdo no nome
+# (css/operador.3f2a1b9c0d.css): a URL muda quando o arquivo muda, então o
+# navegador guarda cada um para sempre sem revalidar. Todos são lidos e
+# comprimidos uma vez por processo, na primeira página ou arquivo pedido.
+ASSETS_MAX_AGE = 365 * 24 * 3600
+_ASSETS_COMPRIMIVEIS = ('.css', '.js', '.svg')
+
+# Alturas geradas do logo: 1x, 2x e 3x dos 56px em que ele aparece nas telas
+LOGO_ALTURAS = (56, 112, 168)
+
+_assets = {}          # nome em static/ -> nome com hash
+_assets_por_url = {}  # nome com hash -> (conteúdo preparado, mimetype)
+_assets_lock = threading.Lock()
+
+def _carregar_assets():
+    """Lê e prepara todos os arquivos de static/ (uma vez por processo)"""
+    with _assets_lock:
+        if _assets:
+            return
+        for pasta, _, arquivos in os.walk(app.static_folder):
+            for arquivo in arquivos:
+                caminho = os.path.join(pasta, arquivo)
+                nome = os.path.relpath(caminho, app.static_folder).replace(os.sep, '/')
+                with open(caminho, 'rb') as f:
+                    conteudo = preparar_conteudo(f.read(), comprimir=nome.endswith(_ASSETS_COMPRIMIVEIS))
+                base, extensao = os.path.splitext(nome)
+                com_hash = f"{base}.{conteudo['etag'][:10]}{extensao}"
+                mimetype = mimetypes.guess_type(nome)[0] or 'application/octet-stream'
+                _assets_por_url[com_hash] = (conteudo, mimetype)
+                _assets[nome] = com_hash
+
+def asset(nome):
+    """URL com hash de um arquivo de static/ (para os templates)"""
+    _carregar_assets()
+    return url_for('servir_asset', nome=_assets[nome])
+
+app.jinja_env.globals['asset'] = asset
+
+def gerar_logos():
+    """Grava em static/ as versões reduzidas do logo (precisa do Pillow)"""
+    from PIL import Image
+    with Image.open(os.path.join(app.static_folder, 'logo-bom-sabor.png')) as logo:
+        for altura in LOGO_ALTURAS:
+            largura = round(logo.width * altura / logo.height)
+            reduzido = logo.resize((largura, altura), Image.LANCZOS)
+            reduzido.save(os.path.join(app.static_folder, f'logo-bom-sabor-{altura}.png'), optimize=True)
+
+# Compressão das respostas da API
+# JSON a partir de COMPRESSAO_MIN_BYTES sai em brotli ou gzip, conforme o
+# Accept-Encoding (os navegadores descomprimem sozinhos, nada muda nas telas).
+# Rotas cujo corpo é fixo para uma versão (a fila completa, os lotes) marcam a
+# resposta com chave_compressao, e os bytes comprimidos são reaproveitados por
+# todas as telas até a versão mudar; o resto é comprimido a cada resposta.
+COMPRESSAO_MIN_BYTES = 1024
+COMPRESSAO_CACHE_MAX = 16
+_COMPRESSAO_NIVEL = {'br': 5, 'gzip': 6}
+
+_comprimidos = {}  # (chave_compressao, codificação) -> bytes
+_comprimidos_lock = threading.Lock()
+
+def _comprimir(corpo, codificacao):
+    """Corpo comprimido em 'br' ou 'gzip'"""
+    if codificacao == 'br':
+        return brotli.compress(corpo, quality=_COMPRESSAO_NIVEL['br'])
+    return gzip.compress(corpo, compresslevel=_COMPRESSAO_NIVEL['gzip'], mtime=0)
+
+@app.after_request
+def comprimir_json(resposta):
+    """Comprime respostas JSON grandes quando o cliente aceita"""
+    if (resposta.mimetype != 'application/json' or resposta.status_code != 200
+            or resposta.is_streamed or 'Content-Encoding' in resposta.headers):
+        return resposta
+    resposta.vary.add('Accept-Encoding')
+    corpo = resposta.get_data()
+    if len(corpo) < COMPRESSAO_MIN_BYTES:
+        return resposta
+    if brotli is not None and 'br' in request.accept_encodings:
+        codificacao = 'br'
+    elif 'gzip' in request.accept_encodings:
+        codificacao = 'gzip'
+    else:
+        return resposta
+
+    chave = getattr(resposta, 'chave_compressao', None)
+    comprimido = _comprimidos.get((chave, codificacao)) if chave else None
+    if comprimido is None:
+        comprimido = _comprimir(corpo, codificacao)
+        if chave:
+            with _comprimidos_lock:
+                _comprimidos[(chave, codificacao)] = comprimido
+                while len(_comprimidos) > COMPRESSAO_CACHE_MAX:
+                    del _comprimidos[next(iter(_comprimidos))]
+    resposta.set_data(comprimido)
+    resposta.headers['Content-Encoding'] = codificacao
+    return resposta
+
+# Métricas
+# Contagem, latência e tempo no SQLite por rota, expostos em /metrics no formato
+# texto do Prometheus. Cada processo guarda as suas (com vários workers, cada
+# raspagem cai em um deles; o rótulo pid separa as séries).
+METRICAS_LIMITES = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+class Histograma:
+    """Observações por faixa de METRICAS_LIMITES, mais soma e total"""
+
+    __slots__ = ('faixas', 'soma', 'total')
+
+    def __init__(self):
+        self.faixas = [0] * len(METRICAS_LIMITES)
+        self.soma = 0.0
+        self.total = 0
+
+    def observar(self, segundos):
+        faixa = bisect_left(METRICAS_LIMITES, segundos)
+        if faixa < len(self.faixas):
+            self.faixas[faixa] += 1
+        self.soma += segundos
+        self.total += 1
+
+    def linhas(self, nome, rotulos):
+        acumulado = 0
+        for limite, quantidade in zip(METRICAS_LIMITES, self.faixas):
+            acumulado += quantidade
+            yield f'{nome}_bucket{{{rotulos},le="{limite}"}} {acumulado}'
+        yield f'{nome}_bucket{{{rotulos},le="+Inf"}} {self.total}'
+        yield f'{nome}_sum{{{rotulos}}} {self.soma:.6f}'
+        yield f'{nome}_count{{{rotulos}}} {self.total}'
+
+class Metricas:
+    """Métricas das requisições deste processo"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requisicoes = {}  # (metodo, rota, status) -> quantidade
+        self.latencia = {}     # (metodo, rota) -> Histograma da requisição inteira
+        self.banco = {}        # (metodo, rota) -> Histograma do tempo dentro do SQLite
+        self.comandos = {}     # (metodo, rota) -> comandos SQL executados
+
+    def registrar(self, metodo, rota, status, segundos, segundos_banco, comandos):
+        chave = (metodo, rota)
+        with self.lock:
+            self.requisicoes[(metodo, rota, status)] = self.requisicoes.get((metodo, rota, status), 0) + 1
+            if chave not in self.latencia:
+                self.latencia[chave] = Histograma()
+                self.banco[chave] = Histograma()
+                self.comandos[chave] = 0
+            self.latencia[chave].observar(segundos)
+            self.banco[chave].observar(segundos_banco)
+            self.comandos[chave] += comandos
+
+    def texto(self):
+        """Tudo no formato de exposição do Prometheus (text/plain 0.0.4)"""
+        pid = os.getpid()
+        with self.lock:
+            linhas = [
+                '# HELP pedidos_http_requisicoes_total Requisições atendidas, por rota e status.',
+                '# TYPE pedidos_http_requisicoes_total counter',
+            ]
+            for (metodo, rota, status), quantidade in sorted(self.requisicoes.items()):
+                linhas.append(f'pedidos_http_requisicoes_total{{pid="{pid}",metodo="{metodo}",'
+                              f'rota="{rota}",status="{status}"}} {quantidade}')
+            linhas += [
+                '# HELP pedidos_http_duracao_segundos Duração das requisições.',
+                '# TYPE pedidos_http_duracao_segundos histogram',
+            ]
+            for (metodo, rota), histograma in sorted(self.latencia.items()):
+                linhas.extend(histograma.linhas('pedidos_http_duracao_segundos',
+                                                f'pid="{pid}",metodo="{metodo}",rota="{rota}"'))
+            linhas += [
+                '# HELP pedidos_banco_duracao_segundos Tempo de cada requisição dentro do SQLite.',
+                '# TYPE pedidos_banco_duracao_segundos histogram',
+            ]
+            for (metodo, rota), histograma in sorted(self.banco.items()):
+                linhas.extend(histograma.linhas('pedidos_banco_duracao_segundos',
+                                                f'pid="{pid}",metodo="{metodo}",rota="{rota}"'))
+            linhas += [
+                '# HELP pedidos_banco_comandos_total Comandos SQL executados pelas requisições.',
+                '# TYPE pedidos_banco_comandos_total counter',
+            ]
+            for (metodo, rota), quantidade in sorted(self.comandos.items()):
+                linhas.append(f'pedidos_banco_comandos_total{{pid="{pid}",metodo="{metodo}",'
+                              f'rota="{rota}"}} {quantidade}')
+
+        with _pool_lock:
+            abertas, ociosas = len(_conexoes_abertas), len(_pool)
+        linhas += [
+            '# HELP pedidos_fila_pendentes Pedidos na fila de produção.',
+            '# TYPE pedidos_fila_pendentes gauge',
+            f'pedidos_fila_pendentes{{pid="{pid}"}} {len(_cache_fila.pedidos)}',
+            f'# HELP pedidos_fila_em_risco Pendentes a menos de {EM_RISCO_MIN} minutos do prazo de retirada.',
+            '# TYPE pedidos_fila_em_risco gauge',
+            f'pedidos_fila_em_risco{{pid="{pid}"}} {_cache_fila.em_risco()}',
+            '# HELP pedidos_fila_versao Versão atual da fila.',
+            '# TYPE pedidos_fila_versao gauge',
+            f'pedidos_fila_versao{{pid="{pid}"}} {_versao_fila}',
+            '# HELP pedidos_banco_conexoes Conexões SQLite abertas (e quantas estão paradas no pool).',
+            '# TYPE pedidos_banco_conexoes gauge',
+            f'pedidos_banco_conexoes{{pid="{pid}",estado="abertas"}} {abertas}',
+            f'pedidos_banco_conexoes{{pid="{pid}",estado="ociosas"}} {ociosas}',
+        ]
+        return '\n'.join(linhas) + '\n'
+
+_metricas = Metricas()
+
+@app.before_request
+def iniciar_medicao():
+    """Marca o início da requisição e zera o acumulador de tempo no banco"""
+    _local.inicio_requisicao = time.perf_counter()
+    _local.banco = [0.0, 0]
+
+@app.after_request
+def registrar_medicao(resposta):
+    """Registra latência, tempo no banco e status da requisição"""
+    inicio = getattr(_local, 'inicio_requisicao', None)
+    if inicio is not None:
+        segundos_banco, comandos = _local.banco
+        _local.inicio_requisicao = _local.banco = None
+        rota = request.url_rule.rule if request.url_rule else 'desconhecida'
+        _metricas.registrar(request.method, rota, resposta.status_code,
+                            time.perf_counter() - inicio, segundos_banco, comandos)
+    return resposta
+
+@app.route('/metrics')
+def metrics():
+    """Métricas deste processo para o Prometheus"""
+    return Response(_metricas.texto(), mimetype='text/plain; version=0.0.4')
+
 # Rotas
 
+@app.errorhandler(sqlite3.OperationalError)
+def banco_ocupado(erro):
+    """Banco travado por outra escrita além do busy_timeout: 503 para o cliente tentar de novo"""
+    if 'locked' not in str(erro) and 'busy' not in str(erro):
+        raise erro
+    resposta = jsonify({'sucesso': False, 'erro': 'Banco ocupado, tente novamente'})
+    resposta.status_code = 503
+    resposta.headers['Retry-After'] = '1'
+    return resposta
+
+_servico = {'pid': None}
+
+def iniciar_servico():
+    """Prepara o processo para atender: banco migrado e threads vigia e de arquivamento.
+
+    Só os pontos de entrada do servidor chamam isto; scripts que usam init_db
+    (carga de teste, reprocessamento) não ganham threads rodando por baixo.
+    """
+    if _inicializado['pid'] != os.getpid():
+        init_db()
+    _garantir_vigia()
+    _garantir_arquivador()
+    _servico['pid'] = os.getpid()
+
+@app.before_request
+def inicializar_processo():
+    """Garante o serviço iniciado uma vez por processo (gunicorn/uvicorn com vários workers)"""
+    if _servico['pid'] != os.getpid():
+        iniciar_servico()
+
+def pedido_para_dict(p):
+    """Converte uma linha de _SELECT_PEDIDO no formato da API"""
+    return {
+        'id': p['id'],
+        'cliente': p['cliente'],
+        'telefone': p['telefone'],
+        'itens': json.loads(p['itens']),
+        'criado_em': p['criado_em'],
+        'retirar_as': p['retirar_as'],
+        'prazo': p['prazo'].replace(' ', 'T') + 'Z' if p['prazo'] else None,
+        'modificado': p['modificado'],
+        'versao': p['versao'],
+    }
+
+def idempotente(view):
+    """Rotas de escrita: com o cabeçalho Idempotency-Key, repetições recebem a resposta da primeira vez"""
+    @wraps(view)
+    def envoltorio(*args, **kwargs):
+        chave = request.headers.get('Idempotency-Key')
+        if not chave:
+            return view(*args, **kwargs)
+        if len(chave) > IDEMPOTENCIA_CHAVE_MAX:
+            return jsonify({'sucesso': False, 'erro': 'Chave de idempotência muito longa'}), 400
+
+        rota = request.url_rule.rule
+        # A rota roda dentro desta transação (as transacao() dos helpers entram nela),
+        # então escrita e chave são confirmadas juntas e os ganchos de commit só rodam
+        # no fim. Uma repetição simultânea espera o lock e já encontra a chave.
+        with transacao() as conn:
+            anterior = resultado_idempotente(conn, chave)
+            if anterior is None:
+                resposta = app.make_response(view(*args, **kwargs))
+                if resposta.status_code < 500:
+                    guardar_idempotente(conn, chave, rota, resposta.status_code, resposta.get_data(as_text=True))
+                return resposta
+
+        if anterior['rota'] != rota:
+            return jsonify({'sucesso': False, 'erro': 'Chave de idempotência já usada em outra rota'}), 422
+        resposta = Response(anterior['resposta'], status=anterior['status'], mimetype='application/json')
+        resposta.headers['Idempotent-Replayed'] = 'true'
+        return resposta
+    return envoltorio
+
+def resposta_conflito(erro):
+    """409 com o estado atual do pedido, para a tela se atualizar e decidir de novo"""
+    pedido = get_pedido(erro.pedido_id)
+    return jsonify({
+        'sucesso': False,
+        'erro': str(erro),
+        'pedido': pedido_para_dict(pedido) if pedido and pedido['status'] == 'pendente' else None,
+    }), 409
+
 @app.route('/')
 def index():
     return redirect('/operador')
 
 @app.route('/operador')
 def operador():
-    return render_template_string(TEMPLATE_OPERADOR)
+    return pagina('operador')
 
 @app.route('/producao')
 def producao():
-    return render_template_string(TEMPLATE_PRODUCAO)
-
-@app.route('/api/novo-pedido', methods=['POST'])
-def novo_pedido():
-    data = request.get_json()
-    cliente = data.get('cliente', '').strip()
-    telefone = data.get('telefone', '').strip()
-    itens = data.get('itens', [])
-    retirar_as = data.get('retirar_as', '').strip()
+    return pagina('producao')
+
+@app.route('/producao/lotes')
+def producao_lotes():
+    return pagina('lotes')
+
+@app.route('/historico')
+def pagina_historico():
+    return pagina('historico')
+
+@app.route('/assets/<path:nome>')
+def servir_asset(nome):
+    """Arquivo de static/ pelo nome com hash; o conteúdo daquela URL nunca muda"""
+    _carregar_assets()
+    encontrado = _assets_por_url.get(nome)
+    if encontrado is None:
+        return Response(status=404)
+    conteudo, mimetype = encontrado
+    return responder_conteudo(conteudo, mimetype, f'public, max-age={ASSETS_MAX_AGE}, immutable')
+
+def item_valido(item):
+    """Item vindo do JSON: um objeto com descrição, corte e tempero em texto (o moído pode vir como número)"""
+    return isinstance(item, dict) and all(
+        item.get(campo) is None or isinstance(item.get(campo), str)
+        for campo in ('descricao', 'corte', 'temperar')
+    )
+
+def validar_pedido(data):
+    """Normaliza o JSON de um pedido; retorna (pedido, None) ou (None, mensagem de erro)"""
+    if not isinstance(data, dict):
+        return None, 'Pedido inválido'
+    if not all(isinstance(data.get(campo) or '', str) for campo in ('cliente', 'telefone', 'retirar_as')):
+        return None, 'Dados inválidos'
+    cliente = (data.get('cliente') or '').strip()
+    telefone = (data.get('telefone') or '').strip()
+    itens = data.get('itens') or []
+    retirar_as = (data.get('retirar_as') or '').strip()
     
     if not cliente:
-        return jsonify({'sucesso': False, 'erro': 'Nome do cliente é obrigatório'})
+        return None, 'Nome do cliente é obrigatório'
     
     if not itens:
-        return jsonify({'sucesso': False, 'erro': 'Adicione pelo menos um item'})
+        return None, 'Adicione pelo menos um item'
+
+    if not isinstance(itens, list) or not all(item_valido(item) for item in itens):
+        return None, 'Itens inválidos'
+
+    return {'cliente': cliente, 'telefone': telefone, 'itens': itens, 'retirar_as': retirar_as or None}, None
+
+# Limite de entradas por requisição nos endpoints em lote
+LOTE_MAX = 500
+
+@app.route('/api/novo-pedido', methods=['POST'])
+@idempotente
+def novo_pedido():
+    pedido, erro = validar_pedido(request.get_json())
+    if erro:
+        return jsonify({'sucesso': False, 'erro': erro})
     
-    salvar_pedido(cliente, telefone, itens, retirar_as or None)
-    return jsonify({'sucesso': True})
+    pedido_id = salvar_pedido(**pedido)
+    return jsonify({'sucesso': True, 'id': pedido_id})
+
+@app.route('/api/novo-pedido-lote', methods=['POST'])
+@idempotente
+def novo_pedido_lote():
+    """Cria vários pedidos numa só transação; o resultado vem na mesma ordem da entrada.
+
+    Cada entrada pode trazer sua própria "chave" de idempotência (a mesma de
+    /api/novo-pedido): entradas já gravadas devolvem o resultado original.
+    """
+    corpo = request.get_json()
+    entradas = (corpo.get('pedidos') if isinstance(corpo, dict) else None) or []
+    if not isinstance(entradas, list):
+        return jsonify({'sucesso': False, 'erro': 'Envie os pedidos numa lista'}), 400
+    if len(entradas) > LOTE_MAX:
+        return jsonify({'sucesso': False, 'erro': f'No máximo {LOTE_MAX} pedidos por lote'}), 400
+
+    with transacao() as conn:
+        resultados = []
+        validos = []
+        chaves_novas = {}  # chave -> posição do seu resultado neste lote
+        repetidas = []     # (posição, posição da primeira entrada com a mesma chave)
+        for entrada in entradas:
+            if not isinstance(entrada, dict):
+                resultados.append({'sucesso': False, 'erro': 'Pedido inválido'})
+                continue
+            chave = entrada.get('chave')
+            if chave:
+                chave = str(chave)[:IDEMPOTENCIA_CHAVE_MAX]
+                if chave in chaves_novas:
+                    repetidas.append((len(resultados), chaves_novas[chave]))
+                    resultados.append(None)
+                    continue
+                anterior = resultado_idempotente(conn, chave)
+                if anterior is not None:
+                    resultados.append(json.loads(anterior['resposta']) if anterior['rota'] == '/api/novo-pedido'
+                                      else {'sucesso': False, 'erro': 'Chave de idempotência já usada em outra rota'})
+                    continue
+            pedido, erro = validar_pedido(entrada)
+            if erro:
+                resultados.append({'sucesso': False, 'erro': erro})
+            else:
+                resultados.append(len(validos))
+                validos.append(pedido)
+            if chave:
+                chaves_novas[chave] = len(resultados) - 1
+
+        ids = salvar_pedidos(validos) if validos else []
+        resultados = [{'sucesso': True, 'id': ids[r]} if isinstance(r, int) else r for r in resultados]
+        for posicao, original in repetidas:
+            resultados[posicao] = resultados[original]
+        for chave, posicao in chaves_novas.items():
+            guardar_idempotente(conn, chave, '/api/novo-pedido', 200, json.dumps(resultados[posicao]))
+    return jsonify({'sucesso': True, 'resultados': resultados})
 
 @app.route('/api/pedidos-pendentes', methods=['GET'])
 def pedidos_pendentes():
-    pedidos = get_pedidos_pendentes()
-    pedidos_list = [
-        {
-            'id': p['id'],
-            'cliente': p['cliente'],
-            'telefone': p['telefone'],
-            'itens': p['itens'],
-            'criado_em': p['criado_em'],
-            'retirar_as': p['retirar_as'],
-            'modificado': p['modificado'],
-        }
-    
-        for p in pedidos
-    ]
-    return jsonify({'pedidos': pedidos_list})
+    """Fila de pendentes: inteira, ou só o delta quando o cliente manda since=<versão>"""
+    cache = cache_fila()
+    versao = cache.versao
+    etag = etag_fila(versao)
+    desde = request.args.get('since', type=int)
+    if desde == versao or request.if_none_match.contains(etag):
+        resposta = Response(status=304)
+        resposta.set_etag(etag)
+        resposta.headers['Cache-Control'] = 'no-cache'
+        return resposta
+
+    # Os arrays já estão serializados (no cache ou pelo SQLite); aqui só entra o envelope
+    delta = None
+    if desde is not None and 0 < desde < versao and versao - desde <= DELTA_MAX_VERSOES:
+        delta = cache.delta(desde) or get_delta_fila(desde)
+    if delta:
+        versao, alterados, removidos, ordem = delta
+        corpo = (f'{{"completo":false,"versao":{versao},"alterados":{alterados},'
+                 f'"removidos":{removidos},"ordem":{ordem}}}')
+    else:
+        versao, pedidos = cache.completo()
+        corpo = f'{{"completo":true,"versao":{versao},"pedidos":{pedidos}}}'
+
+    resposta = Response(corpo, mimetype='application/json')
+    if not delta:
+        resposta.chave_compressao = f'fila-{versao}'
+    resposta.set_etag(etag_fila(versao))
+    resposta.headers['Cache-Control'] = 'no-cache'
+    return resposta
+
+def _inicio_do_dia_utc(data, dias=0):
+    """'AAAA-MM-DD' (dia local) -> instante UTC em que esse dia (mais `dias`) começa, no formato do banco"""
+    dia = datetime.strptime(data, '%Y-%m-%d') + timedelta(days=dias)
+    return _formatar_timestamp(dia.astimezone(timezone.utc))
+
+@app.route('/api/historico', methods=['GET'])
+def historico():
+    """Busca no histórico por cliente/telefone (q), dias (de, ate), status; paginada por cursor"""
+    args = request.args
+    try:
+        de = _inicio_do_dia_utc(args['de']) if args.get('de') else None
+        ate = _inicio_do_dia_utc(args['ate'], dias=1) if args.get('ate') else None
+        limite = min(args.get('limite', HISTORICO_POR_PAGINA, type=int), HISTORICO_MAX_POR_PAGINA)
+        apos = None
+        if args.get('cursor'):
+            criado_em, pedido_id = args['cursor'].rsplit('|', 1)
+            apos = (criado_em, int(pedido_id))
+    except ValueError:
+        return jsonify({'sucesso': False, 'erro': 'Filtros inválidos'}), 400
+    status = args.get('status') or None
+    if status not in (None, 'pendente', 'pronto'):
+        return jsonify({'sucesso': False, 'erro': 'Status inválido'}), 400
+
+    linhas = buscar_historico(args.get('q'), de, ate, status, apos, max(limite, 1))
+    proximo = None
+    if len(linhas) == max(limite, 1):
+        proximo = f"{linhas[-1]['criado_em']}|{linhas[-1]['id']}"
+    return jsonify({
+        'sucesso': True,
+        'pedidos': [dict(pedido_para_dict(p), status=p['status']) for p in linhas],
+        'proximo': proximo,
+    })
+
+@app.route('/api/relatorio', methods=['GET'])
+def relatorio():
+    """Relatório de vendas e produção entre dois dias locais (padrão: hoje)"""
+    hoje = datetime.now().strftime('%Y-%m-%d')
+    de = request.args.get('de') or hoje
+    ate = request.args.get('ate') or de
+    try:
+        datetime.strptime(de, '%Y-%m-%d')
+        datetime.strptime(ate, '%Y-%m-%d')
+    except ValueError:
+        return jsonify({'sucesso': False, 'erro': 'Datas devem estar no formato AAAA-MM-DD'}), 400
+    return jsonify(dict(get_relatorio(de, ate), sucesso=True))
+
+@app.route('/api/lotes', methods=['GET'])
+def lotes():
+    """Itens pendentes agrupados por corte, moído e tempero, com os pedidos de cada grupo"""
+    cache = cache_fila()
+    versao, corpo = cache.lotes_json()
+    etag = f'lotes-{versao}'
+    if request.if_none_match.contains(etag):
+        resposta = Response(status=304)
+    else:
+        resposta = Response(f'{{"versao":{versao},"lotes":{corpo}}}', mimetype='application/json')
+        resposta.chave_compressao = etag
+    resposta.set_etag(etag)
+    resposta.headers['Cache-Control'] = 'no-cache'
+    return resposta
+
+def evento_sse(versao):
+    """Mensagem SSE que avisa a versão atual da fila"""
+    return f'event: versao\ndata: {versao}\n\n'
+
+# Cabeçalhos do stream (usados também pelo modo assíncrono)
+CABECALHOS_STREAM = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no',
+}
+
+@app.route('/api/pedidos-stream', methods=['GET'])
+def pedidos_stream():
+    """Server-Sent Events: avisa a produção sempre que a fila muda"""
+    def eventos():
+        versao = _versao_fila
+        yield 'retry: 2000\n' + evento_sse(versao)
+        while True:
+            nova = aguardar_mudanca(versao, STREAM_HEARTBEAT)
+            if nova == versao:
+                yield ': ping\n\n'
+                continue
+            versao = nova
+            yield evento_sse(versao)
+
+    return Response(eventos(), mimetype='text/event-stream', headers=CABECALHOS_STREAM)
 
 @app.route('/api/marcar-pronto', methods=['POST'])
+@idempotente
 def marcar_como_pronto():
     data = request.get_json()
     pedido_id = data.get('id')
     marcar_pronto(pedido_id)
     return jsonify({'sucesso': True})
 
+@app.route('/api/marcar-pronto-lote', methods=['POST'])
+@idempotente
+def marcar_como_pronto_lote():
+    """Marca uma lista de pedidos como prontos numa só transação, com resultado por id"""
+    try:
+        ids = [int(pedido_id) for pedido_id in (request.get_json() or {}).get('ids') or []]
+    except (TypeError, ValueError):
+        return jsonify({'sucesso': False, 'erro': 'Dados inválidos'}), 400
+    if len(ids) > LOTE_MAX:
+        return jsonify({'sucesso': False, 'erro': f'No máximo {LOTE_MAX} pedidos por lote'}), 400
+
+    marcados = marcar_prontos(ids)
+    resultados = [
+        {'id': pedido_id, 'sucesso': True} if pedido_id in marcados
+        else {'id': pedido_id, 'sucesso': False, 'erro': 'Pedido não está pendente'}
+        for pedido_id in ids
+    ]
+    return jsonify({'sucesso': True, 'resultados': resultados})
+
 @app.route('/api/cancelar-item', methods=['POST'])
+@idempotente
 def cancelar_item():
     data = request.get_json()
     pedido_id = data.get('pedido_id')
-    item_index = data.get('item_index')
-    cancelar_item_pedido(pedido_id, item_index)
-    return jsonify({'sucesso': True})
+    item_id = data.get('item_id')
+    if item_id is None and data.get('item_index') is not None:
+        item_id = item_id_por_posicao(pedido_id, data.get('item_index'))
+    if item_id is None:
+        return jsonify({'sucesso': False, 'erro': 'Dados inválidos'})
+
+    try:
+        versao = cancelar_item_pedido(pedido_id, item_id, data.get('versao'))
+    except ConflitoVersao as erro:
+        return resposta_conflito(erro)
+    return jsonify({'sucesso': True, 'versao': versao})
 
 @app.route('/api/modificar-item', methods=['POST'])
+@idempotente
 def modificar_item():
     data = request.get_json()
     pedido_id = data.get('pedido_id')
-    item_index = data.get('item_index')
+    item_id = data.get('item_id')
     novo_item = data.get('novo_item')
+    if item_id is None and data.get('item_index') is not None:
+        item_id = item_id_por_posicao(pedido_id, data.get('item_index'))
     
-    if pedido_id is not None and item_index is not None and novo_item:
-        modificar_item_pedido(pedido_id, item_index, novo_item)
-        return jsonify({'sucesso': True})
+    if pedido_id is not None and item_id is not None and novo_item and item_valido(novo_item):
+        try:
+            versao = modificar_item_pedido(pedido_id, item_id, novo_item, data.get('versao'))
+        except ConflitoVersao as erro:
+            return resposta_conflito(erro)
+        return jsonify({'sucesso': True, 'versao': versao})
     
     return jsonify({'sucesso': False, 'erro': 'Dados inválidos'})
 
+# Modo assíncrono (ASGI)
+# As rotas continuam sendo as mesmas funções Flask: cada requisição roda o app
+# WSGI num pool limitado de threads, que é onde acontece o trabalho no SQLite.
+# Só o stream da produção é atendido direto no laço asyncio, então centenas de
+# telas conectadas não prendem nenhuma thread. Rode com: uvicorn app:asgi_app
+ASYNC_THREADS = 8
+
+_executor_async = None
+_aviso_async = None
+_subida_async = None
+
+class _AvisoAsync:
+    """Versão da fila vista pelo laço asyncio; acorda os streams a cada mudança"""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.evento = asyncio.Event()
+
+    def disparar(self, versao):
+        # Chamado de qualquer thread (ganchos de commit)
+        self.loop.call_soon_threadsafe(self._disparar)
+
+    def _disparar(self):
+        evento, self.evento = self.evento, asyncio.Event()
+        evento.set()
+
+def _environ_wsgi(scope, corpo):
+    """Monta o environ WSGI de uma requisição HTTP ASGI"""
+    servidor = scope.get('server') or ('localhost', 80)
+    cliente = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': servidor[0],
+        'SERVER_PORT': str(servidor[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': cliente[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(corpo),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for nome, valor in scope['headers']:
+        nome = nome.decode('latin-1').upper().replace('-', '_')
+        valor = valor.decode('latin-1')
+        if nome in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            environ[nome] = valor
+            continue
+        chave = f'HTTP_{nome}'
+        environ[chave] = f'{environ[chave]},{valor}' if chave in environ else valor
+    return environ
+
+def _rodar_wsgi(environ):
+    """Executa o app Flask (numa thread do pool) e devolve (status, cabeçalhos, corpo)"""
+    resultado = {}
+
+    def start_response(status, headers, exc_info=None):
+        resultado['status'] = int(status.split(' ', 1)[0])
+        resultado['headers'] = [(k.encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+
+    iterador = app(environ, start_response)
+    try:
+        corpo = b''.join(iterador)
+    finally:
+        if hasattr(iterador, 'close'):
+            iterador.close()
+    return resultado['status'], resultado['headers'], corpo
+
+async def _stream_async(send):
+    """/api/pedidos-stream atendido no próprio laço, sem ocupar thread"""
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-type', b'text/event-stream; charset=utf-8')] +
+                   [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in CABECALHOS_STREAM.items()],
+    })
+    versao = _versao_fila
+    await send({'type': 'http.response.body', 'body': ('retry: 2000\n' + evento_sse(versao)).encode(), 'more_body': True})
+    while True:
+        evento = _aviso_async.evento
+        if _versao_fila == versao:
+            try:
+                await asyncio.wait_for(evento.wait(), STREAM_HEARTBEAT)
+            except asyncio.TimeoutError:
+                await send({'type': 'http.response.body', 'body': b': ping\n\n', 'more_body': True})
+                continue
+        versao = _versao_fila
+        await send({'type': 'http.response.body', 'body': evento_sse(versao).encode(), 'more_body': True})
+
+async def _preparar_async():
+    """Pool de threads, aviso da fila e serviço (banco, vigia, arquivador) do laço atual.
+
+    Sobe no lifespan; se o servidor não manda lifespan (uvicorn --lifespan off),
+    sobe na primeira requisição.
+    """
+    global _executor_async, _aviso_async, _subida_async
+    if _executor_async is None:
+        loop = asyncio.get_running_loop()
+        _executor_async = ThreadPoolExecutor(max_workers=ASYNC_THREADS, thread_name_prefix='db')
+        _aviso_async = _AvisoAsync(loop)
+        _ouvintes_fila.append(_aviso_async.disparar)
+        _subida_async = loop.run_in_executor(_executor_async, iniciar_servico)
+    await _subida_async
+
+async def _aguardar_desconexao(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+async def _lifespan(receive, send):
+    global _executor_async, _aviso_async, _subida_async
+    while True:
+        mensagem = await receive()
+        if mensagem['type'] == 'lifespan.startup':
+            await _preparar_async()
+            await send({'type': 'lifespan.startup.complete'})
+        elif mensagem['type'] == 'lifespan.shutdown':
+            _ouvintes_fila.remove(_aviso_async.disparar)
+            _executor_async.shutdown(wait=True)
+            _executor_async = _aviso_async = _subida_async = None
+            fechar_conexoes()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def asgi_app(scope, receive, send):
+    """Entrada ASGI: mesmas rotas do Flask, servidas por um laço asyncio"""
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+    await _preparar_async()
+
+    if scope['path'] == '/api/pedidos-stream' and scope['method'] == 'GET':
+        # O stream só termina quando o cliente desconecta
+        tarefas = {asyncio.ensure_future(_stream_async(send)),
+                   asyncio.ensure_future(_aguardar_desconexao(receive))}
+        await asyncio.wait(tarefas, return_when=asyncio.FIRST_COMPLETED)
+        for tarefa in tarefas:
+            tarefa.cancel()
+        await asyncio.gather(*tarefas, return_exceptions=True)
+        return
+
+    corpo = b''
+    while True:
+        mensagem = await receive()
+        if mensagem['type'] == 'http.disconnect':
+            return
+        corpo += mensagem.get('body', b'')
+        if not mensagem.get('more_body'):
+            break
+
+    loop = asyncio.get_running_loop()
+    status, headers, resposta = await loop.run_in_executor(
+        _executor_async, _rodar_wsgi, _environ_wsgi(scope, corpo))
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': resposta})
+
 if __name__ == '__main__':
-    init_db()
+    parser = argparse.ArgumentParser(description='Sistema de Pedidos - Casa de Carnes Bom Sabor')
+    parser.add_argument('--async', dest='modo_async', action='store_true',
+                        help='servir pelo modo assíncrono (ASGI, precisa do uvicorn)')
+    parser.add_argument('--porta', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=1,
+                        help='número de processos (implica --async; padrão: 1)')
+    parser.add_argument('--arquivar-dias', type=int, default=ARQUIVAR_APOS_DIAS,
+                        help=f'arquiva pedidos prontos com mais de N dias (padrão: {ARQUIVAR_APOS_DIAS})')
+    parser.add_argument('--arquivar', action='store_true',
+                        help='só arquiva os pedidos antigos agora e sai')
+    parser.add_argument('--reprocessar-quantidades', action='store_true',
+                        help='relê gramas/unidades de todos os itens a partir da descrição e sai')
+    parser.add_argument('--gerar-logos', action='store_true',
+                        help='regrava as versões reduzidas do logo em static/ e sai (precisa do Pillow)')
+    args = parser.parse_args()
+    try:
+        verificar_sqlite()
+    except RuntimeError as erro:
+        sys.exit(str(erro))
+    # Vale também para os workers do uvicorn, que importam o app de novo
+    os.environ['PEDIDOS_ARQUIVAR_DIAS'] = str(args.arquivar_dias)
+    ARQUIVAR_APOS_DIAS = args.arquivar_dias
+
+    if args.arquivar:
+        init_db()
+        print(f"📦 {arquivar_antigos()} pedidos arquivados")
+        sys.exit(0)
+
+    if args.reprocessar_quantidades:
+        init_db()
+        reprocessar_quantidades()
+        print("⚖️ Quantidades relidas")
+        sys.exit(0)
+
+    if args.gerar_logos:
+        try:
+            gerar_logos()
+        except ImportError:
+            sys.exit('Gerar os logos precisa do Pillow: pip install Pillow')
+        print(f"🖼️ Logos gerados: {', '.join(f'{altura}px' for altura in LOGO_ALTURAS)}")
+        sys.exit(0)
+
     print("🚀 Servidor rodando!")
-    print("📋 Operador: http://localhost:5000/operador")
-    print("⚡ Produção: http://localhost:5000/producao")
-    app.run(host="0.0.0.0", debug=True, port=5000)
+    print(f"📋 Operador: http://localhost:{args.porta}/operador")
+    print(f"⚡ Produção: http://localhost:{args.porta}/producao")
+
+    if args.modo_async or args.workers > 1:
+        try:
+            import uvicorn
+        except ImportError:
+            sys.exit('O modo assíncrono precisa do uvicorn: pip install uvicorn')
+        if args.workers > 1:
+            # Com vários processos o uvicorn precisa importar o app pelo nome
+            uvicorn.run('app:asgi_app', host="0.0.0.0", port=args.porta, workers=args.workers)
+        else:
+            uvicorn.run(asgi_app, host="0.0.0.0", port=args.porta)
+    else:
+        init_db()
+        # Com o reloader do modo debug este processo só vigia os arquivos; quem
+        # atende (e roda as threads) é o filho, marcado com WERKZEUG_RUN_MAIN
+        if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            iniciar_servico()
+        app.run(host="0.0.0.0", debug=True, port=args.porta)
 
@@ -0,0 +1,63 @@
+let filtros = null;
+let cursor = null;
+
+function formatarData(criadoEm) {
+    // criado_em vem em UTC no formato do SQLite
+    return new Date(criadoEm.replace(' ', 'T') + 'Z').toLocaleString('pt-BR');
+}
+
+function criarPedido(pedido) {
+    const itens = pedido.itens.map(item => {
+        const corte = item.moido ? `${item.corte} (${item.moido}x)` : item.corte;
+        return `${item.descricao} · ${corte}`;
+    }).join(' | ');
+    const el = document.createElement('div');
+    el.className = 'pedido';
+    el.innerHTML = `
+        <div class="pedido-topo">
+            <div>
+                <span class="pedido-cliente"></span>
+                <span class="status ${pedido.status}">${pedido.status}</span>
+            </div>
+            <div class="pedido-data">#${pedido.id} · ${formatarData(pedido.criado_em)}</div>
+        </div>
+        <div class="pedido-data">${pedido.telefone ? 'Telefone: ' : ''}<span class="pedido-telefone"></span></div>
+        <div class="pedido-itens"></div>
+    `;
+    el.querySelector('.pedido-cliente').textContent = pedido.cliente;
+    el.querySelector('.pedido-telefone').textContent = pedido.telefone || '';
+    el.querySelector('.pedido-itens').textContent = itens || 'Todos os itens cancelados';
+    return el;
+}
+
+function buscar(novaBusca) {
+    const resultados = document.getElementById('resultados');
+    if (novaBusca) {
+        filtros = new URLSearchParams(new FormData(document.getElementById('filtros')));
+        cursor = null;
+        resultados.innerHTML = '';
+    }
+    const params = new URLSearchParams(filtros);
+    if (cursor) params.set('cursor', cursor);
+    fetch('/api/historico?' + params)
+        .then(response => response.json())
+        .then(data => {
+            if (!data.sucesso) {
+                resultados.innerHTML = `<div class="vazio">${data.erro}</div>`;
+                return;
+            }
+            data.pedidos.forEach(pedido => resultados.appendChild(criarPedido(pedido)));
+            if (!resultados.children.length) {
+                resultados.innerHTML = '<div class="vazio">Nenhum pedido encontrado</div>';
+            }
+            cursor = data.proximo;
+            document.getElementById('mais').style.display = cursor ? 'block' : 'none';
+        });
+}
+
+document.getElementById('filtros').addEventListener('submit', event => {
+    event.preventDefault();
+    buscar(true);
+});
+document.getElementById('mais').addEventListener('click', () => buscar(false));
+buscar(true);
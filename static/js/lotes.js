@@ -0,0 +1,80 @@
+const EM_RISCO_MS = Number(document.body.dataset.emRiscoMin) * 60 * 1000;
+const TEMPERAR = { 'Sim': 'Temperar', 'Não': 'Sem tempero' };
+
+function formatarQuantidade(lote) {
+    const partes = [];
+    if (lote.gramas) {
+        partes.push(lote.gramas >= 1000
+            ? (lote.gramas / 1000).toLocaleString('pt-BR', { maximumFractionDigits: 3 }) + ' kg'
+            : lote.gramas + ' g');
+    }
+    if (lote.unidades) {
+        partes.push(lote.unidades.toLocaleString('pt-BR') + (lote.unidades === 1 ? ' unidade' : ' unidades'));
+    }
+    return 'Total: ' + partes.join(' + ');
+}
+
+function criarLote(lote) {
+    const corte = lote.moido ? `${lote.corte} (${lote.moido}x)` : lote.corte;
+    // Só conta o horário que algum cliente marcou; o prazo implícito serve só para ordenar
+    const emRisco = lote.prazo_retirada && new Date(lote.prazo_retirada) - Date.now() < EM_RISCO_MS;
+    const el = document.createElement('div');
+    el.className = emRisco ? 'lote em-risco' : 'lote';
+    el.innerHTML = `
+        <div class="lote-topo">
+            <div>
+                <div class="lote-corte"></div>
+                <div class="lote-temperar"></div>
+            </div>
+            <div class="lote-total">${lote.itens}<small>${lote.itens === 1 ? 'item' : 'itens'}</small></div>
+        </div>
+        ${lote.gramas || lote.unidades ? `<div class="lote-quantidade">${formatarQuantidade(lote)}</div>` : ''}
+    `;
+    el.querySelector('.lote-corte').textContent = corte || 'Sem corte';
+    el.querySelector('.lote-temperar').textContent = TEMPERAR[lote.temperar] || 'Tempero: não importa';
+    for (const pedido of lote.pedidos) {
+        // Descrições são texto livre digitado no balcão: entram só como texto
+        const linha = document.createElement('div');
+        const numero = document.createElement('strong');
+        linha.className = 'lote-pedido';
+        numero.textContent = `#${pedido.id}`;
+        linha.append(numero, ' ' + pedido.descricoes.join(' + '));
+        el.appendChild(linha);
+    }
+    return el;
+}
+
+function carregarLotes() {
+    // O navegador revalida com If-None-Match; sem mudança a resposta é 304
+    fetch('/api/lotes', { cache: 'no-cache' })
+        .then(response => response.json())
+        .then(data => {
+            document.getElementById('lotes').replaceChildren(...data.lotes.map(criarLote));
+            document.getElementById('vazio').style.display = data.lotes.length ? 'none' : '';
+        });
+}
+
+let pollingTimer = null;
+
+function conectarStream() {
+    if (!window.EventSource) {
+        pollingTimer = setInterval(carregarLotes, 5000);
+        return;
+    }
+    const stream = new EventSource('/api/pedidos-stream');
+    stream.addEventListener('versao', carregarLotes);
+    stream.onopen = () => {
+        clearInterval(pollingTimer);
+        pollingTimer = null;
+    };
+    stream.onerror = () => {
+        if (!pollingTimer) pollingTimer = setInterval(carregarLotes, 5000);
+        if (stream.readyState === EventSource.CLOSED) {
+            setTimeout(conectarStream, 5000);
+        }
+    };
+}
+
+carregarLotes();
+setInterval(carregarLotes, 60000);  // reavalia os destaques de prazo
+conectarStream();
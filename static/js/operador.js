@@ -0,0 +1,331 @@
+let itemCount = 1;
+
+function selecionarCorte(btn, itemIndex) {
+    event.preventDefault();
+    const corte = btn.getAttribute('data-corte');
+    const botoesDesse = document.querySelectorAll(`#item-${itemIndex} .corte-btn`);
+
+    if (btn.classList.contains('active')) {
+        btn.classList.remove('active');
+        document.getElementById(`corte-${itemIndex}`).value = '';
+
+        const moidoContainer = document.getElementById(`moido-container-${itemIndex}`);
+        moidoContainer.classList.remove('show');
+        const moidoInput = document.getElementById(`moido-${itemIndex}`);
+        if (moidoInput) moidoInput.required = false;
+    } else {
+        botoesDesse.forEach(b => b.classList.remove('active'));
+
+        btn.classList.add('active');
+        document.getElementById(`corte-${itemIndex}`).value = corte;
+
+        const moidoContainer = document.getElementById(`moido-container-${itemIndex}`);
+        const moidoInput = document.getElementById(`moido-${itemIndex}`);
+        if (corte === "Moído X vezes") {
+            moidoContainer.classList.add('show');
+            if (moidoInput) moidoInput.required = true;
+        } else {
+            moidoContainer.classList.remove('show');
+            if (moidoInput) moidoInput.required = false;
+        }
+    }
+}
+
+function selecionarTemperar(btn, itemIndex) {
+    event.preventDefault();
+    const temperar = btn.getAttribute('data-temperar');
+    const botoesDesse = document.querySelectorAll(`#item-${itemIndex} .temperar-btn`);
+
+    if (btn.classList.contains('active')) {
+        btn.classList.remove('active');
+        document.getElementById(`temperar-${itemIndex}`).value = '';
+    } else {
+        botoesDesse.forEach(b => b.classList.remove('active'));
+        btn.classList.add('active');
+        document.getElementById(`temperar-${itemIndex}`).value = temperar;
+    }
+}
+
+function adicionarItem() {
+    event.preventDefault();
+
+    const container = document.getElementById('itensContainer');
+    const novoItem = document.createElement('div');
+    novoItem.className = 'item-form removivel';
+    novoItem.id = `item-${itemCount}`;
+
+    novoItem.innerHTML = document.getElementById('modeloItem').innerHTML
+        .replaceAll('__i__', itemCount)
+        .replaceAll('__numero__', itemCount + 1);
+
+    container.appendChild(novoItem);
+    itemCount++;
+}
+
+function removerItem(index) {
+    event.preventDefault();
+    const el = document.getElementById(`item-${index}`);
+    if (el) el.remove();
+}
+
+// Fila de saída: o pedido confirmado fica guardado neste aparelho (localStorage)
+// e vai para o servidor em lotes, tentando de novo com espera crescente se ele
+// estiver fora, lento ou com erro (5xx, respeitando Retry-After). Cada pedido
+// leva sua chave de idempotência, então um reenvio (ou outra aba enviando a
+// mesma fila) não duplica nada. O que o servidor recusa (4xx) sai da fila e
+// fica em RECUSADOS até o operador reenviar ou descartar, para não travar os
+// pedidos seguintes.
+const FILA_SAIDA = 'pedidos_a_enviar';
+const RECUSADOS = 'pedidos_recusados';
+const LOTE_ENVIO = 20;
+const ESPERA_MAX_MS = 30000;
+const ULTIMOS_ENVIOS = 5;
+let enviando = false;
+let tentativasEnvio = 0;
+let timerEnvio = null;
+let envios = [];
+
+function novaChave() {
+    if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+    const bytes = crypto.getRandomValues(new Uint8Array(16));
+    return Array.from(bytes, b => b.toString(16).padStart(2, '0')).join('');
+}
+
+function lerFila(nome = FILA_SAIDA) {
+    try {
+        return JSON.parse(localStorage.getItem(nome)) || [];
+    } catch (e) {
+        return [];
+    }
+}
+
+function gravarFila(fila, nome = FILA_SAIDA) {
+    localStorage.setItem(nome, JSON.stringify(fila));
+}
+
+function tirarDaFila(chaves) {
+    // Relê a fila: pedidos confirmados durante o envio continuam nela
+    gravarFila(lerFila().filter(e => !chaves.has(e.chave)));
+}
+
+function recusar(entradas) {
+    gravarFila(lerFila(RECUSADOS).concat(entradas), RECUSADOS);
+    tirarDaFila(new Set(entradas.map(e => e.chave)));
+}
+
+function falhaPassageira(response) {
+    // Erro do servidor ou de um proxy no caminho (500, 502, 504...) passa; 4xx é recusa
+    return response.status >= 500;
+}
+
+function enviarFila() {
+    clearTimeout(timerEnvio);
+    timerEnvio = null;
+    if (enviando) return;
+    const lote = lerFila().slice(0, LOTE_ENVIO);
+    if (lote.length === 0) {
+        mostrarEnvios();
+        return;
+    }
+
+    enviando = true;
+    mostrarEnvios();
+    fetch('/api/novo-pedido-lote', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({
+            pedidos: lote.map(e => Object.assign({chave: e.chave}, e.pedido))
+        })
+    })
+    .then(response => {
+        if (response.ok) return response.json();
+        if (falhaPassageira(response)) {
+            throw {esperaMs: (Number(response.headers.get('Retry-After')) || 0) * 1000};
+        }
+        return response.json().catch(() => ({})).then(data => {
+            const erro = data.erro || `Servidor recusou o envio (HTTP ${response.status})`;
+            recusar(lote.map(e => Object.assign({}, e, {erro: erro})));
+            showError(`${lote.length} pedido(s) recusado(s): ${erro}`);
+            return null;
+        });
+    })
+    .then(data => {
+        if (data) {
+            const recusados = [];
+            data.resultados.forEach((r, i) => {
+                if (r.sucesso) {
+                    envios.unshift({cliente: lote[i].pedido.cliente, id: r.id});
+                } else {
+                    recusados.push(Object.assign({}, lote[i], {erro: r.erro}));
+                    showError(`Pedido de ${lote[i].pedido.cliente} recusado: ${r.erro}`);
+                }
+            });
+            envios = envios.slice(0, ULTIMOS_ENVIOS);
+            recusar(recusados);
+            tirarDaFila(new Set(lote.map(e => e.chave)));
+        }
+        tentativasEnvio = 0;
+        enviando = false;
+        enviarFila();
+    })
+    .catch(falha => {
+        enviando = false;
+        tentativasEnvio++;
+        const espera = Math.min(ESPERA_MAX_MS, 1000 * 2 ** (tentativasEnvio - 1)) * (0.5 + Math.random() / 2);
+        timerEnvio = setTimeout(enviarFila, Math.max(espera, (falha && falha.esperaMs) || 0));
+        mostrarEnvios();
+    });
+}
+
+function reenviarRecusados() {
+    const recusados = lerFila(RECUSADOS).map(e => ({chave: e.chave, pedido: e.pedido}));
+    gravarFila(lerFila().concat(recusados));
+    gravarFila([], RECUSADOS);
+    tentativasEnvio = 0;
+    enviarFila();
+}
+
+function descartarRecusados() {
+    if (!confirm('Descartar os pedidos recusados? Eles não serão enviados.')) return;
+    gravarFila([], RECUSADOS);
+    mostrarEnvios();
+}
+
+function mostrarEnvios() {
+    const fila = lerFila();
+    const recusados = lerFila(RECUSADOS);
+    const partes = [];
+    if (fila.length) {
+        const estado = enviando ? 'enviando…' : (tentativasEnvio ? 'servidor indisponível, tentando de novo' : 'aguardando');
+        partes.push(`${fila.length} pedido(s) a enviar · ${estado}`);
+    }
+    if (recusados.length) partes.push(`${recusados.length} recusado(s) pelo servidor`);
+    document.getElementById('enviosResumo').textContent = partes.join(' · ') || 'Todos os pedidos foram enviados';
+    document.getElementById('enviosAcoes').style.display = recusados.length ? 'flex' : 'none';
+
+    const linhas = recusados.map(e => [e.pedido.cliente, e.erro, 'envio-erro']).concat(
+        fila.map(e => [e.pedido.cliente, 'a enviar', 'envio-pendente']),
+        envios.map(e => [e.cliente, `enviado · nº ${e.id}`, 'envio-enviado'])
+    );
+    const lista = document.getElementById('enviosLista');
+    lista.innerHTML = '';
+    for (const [cliente, texto, classe] of linhas) {
+        const li = document.createElement('li');
+        const nome = document.createElement('span');
+        const situacao = document.createElement('span');
+        nome.textContent = cliente;
+        situacao.textContent = texto;
+        situacao.className = classe;
+        li.append(nome, situacao);
+        lista.appendChild(li);
+    }
+    document.getElementById('envios').style.display = linhas.length ? 'block' : 'none';
+}
+
+function submitPedido(event) {
+    event.preventDefault();
+
+    const cliente = document.getElementById('cliente').value.trim();
+    const telefone = document.getElementById('telefone').value.trim();
+    const retirarAs = document.getElementById('retirar_as').value;
+
+    if (!cliente) {
+        showError('Nome do cliente é obrigatório!');
+        return;
+    }
+
+    const itens = [];
+    for (let i = 0; i < itemCount; i++) {
+        const descricao = document.getElementById(`descricao-${i}`);
+        const corte = document.getElementById(`corte-${i}`);
+        const temperar = document.getElementById(`temperar-${i}`);
+
+        if (descricao && descricao.value && descricao.value.trim()) {
+            if (!corte.value || !temperar.value) {
+                showError(`Item #${i + 1}: preencha o corte e se deve temperar.`);
+                return;
+            }
+
+            const item = {
+                descricao: descricao.value.trim(),
+                corte: corte.value,
+                temperar: temperar.value
+            };
+
+            if (corte.value === "Moído X vezes") {
+                const moidoInput = document.getElementById(`moido-${i}`);
+                const moido = moidoInput ? moidoInput.value : '';
+                if (!moido) {
+                    showError(`Item #${i + 1}: informe quantas vezes moído.`);
+                    return;
+                }
+                item.moido = moido;
+            }
+
+            itens.push(item);
+        }
+    }
+
+    if (itens.length === 0) {
+        showError('Adicione pelo menos um item com quantidade.');
+        return;
+    }
+
+    const entrada = {
+        chave: novaChave(),
+        pedido: {
+            cliente: cliente,
+            telefone: telefone,
+            retirar_as: retirarAs,
+            itens: itens
+        }
+    };
+    try {
+        gravarFila(lerFila().concat([entrada]));
+    } catch (e) {
+        showError('Não foi possível guardar o pedido neste aparelho.');
+        return;
+    }
+
+    showSuccess('Pedido registrado!');
+
+    document.getElementById('formPedido').reset();
+
+    for (let i = 1; i < itemCount; i++) {
+        const item = document.getElementById(`item-${i}`);
+        if (item) item.remove();
+    }
+    itemCount = 1;
+
+    setTimeout(() => {
+        document.getElementById('successMsg').style.display = 'none';
+    }, 2500);
+
+    enviarFila();
+}
+
+window.addEventListener('online', () => {
+    tentativasEnvio = 0;
+    enviarFila();
+});
+window.addEventListener('storage', (e) => {
+    if (e.key === FILA_SAIDA || e.key === RECUSADOS) mostrarEnvios();
+});
+enviarFila();
+
+function showSuccess(msg) {
+    const msgDiv = document.getElementById('successMsg');
+    msgDiv.textContent = msg;
+    msgDiv.style.display = 'block';
+}
+
+function showError(msg) {
+    const msgDiv = document.getElementById('errorMsg');
+    msgDiv.textContent = msg;
+    msgDiv.style.display = 'block';
+    setTimeout(() => {
+        msgDiv.style.display = 'none';
+    }, 5000);
+}
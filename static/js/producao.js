@@ -0,0 +1,261 @@
+function formatarTempo(dataString) {
+    const data = new Date(dataString);
+    const agora = new Date();
+    const diff = Math.floor((agora - data) / 1000);
+
+    if (diff < 60) return 'agora';
+    if (diff < 3600) return Math.floor(diff / 60) + 'min atrás';
+    return Math.floor(diff / 3600) + 'h atrás';
+}
+
+function editarPedido(pedidoId) {
+    alert(`Editar pedido #${pedidoId} - Funcionalidade em desenvolvimento`);
+}
+
+
+let versaoFila = null;
+const cards = new Map();  // pedido.id -> { el, versao }
+
+// Pedidos com horário de retirada a menos disso do prazo ficam destacados
+const EM_RISCO_MS = Number(document.body.dataset.emRiscoMin) * 60 * 1000;
+
+function emRisco(prazo) {
+    return new Date(prazo) - Date.now() < EM_RISCO_MS;
+}
+
+function textoRetirada(pedido) {
+    const amanha = new Date(pedido.prazo).toDateString() !== new Date().toDateString();
+    return `Retirar às ${pedido.retirar_as}${amanha ? ' (amanhã)' : ''}`;
+}
+
+function criarCard(pedido, novo) {
+    let itensHTML = '';
+    pedido.itens.forEach(item => {
+        let tempeInfo = '';
+        if (item.temperar === 'Sim') {
+            tempeInfo = `<span class="item-temperar sim">Temperar</span>`;
+        } else if (item.temperar === 'Não') {
+            tempeInfo = `<span class="item-temperar nao">Sem tempero</span>`;
+        } else {
+            tempeInfo = `<span class="item-temperar nao-importa">Não importa</span>`;
+        }
+
+        let corteInfo = item.corte;
+        if (item.corte === 'Moído X vezes' && item.moido) {
+            corteInfo = `${item.corte} (${item.moido}x)`;
+        }
+
+        itensHTML += `
+            <div class="item">
+                <button class="btn-cancelar-item" onclick="cancelarItem(${pedido.id}, ${item.id}, ${pedido.versao})" title="Cancelar item">×</button>
+                <div style="margin-bottom:4px">${tempeInfo}</div>
+                <div class="item-descricao">${item.descricao}</div>
+                <div class="item-corte">Corte: ${corteInfo}</div>
+            </div>
+        `;
+    });
+
+    // Alerta de pedido modificado
+    let alertaModificado = '';
+    if (pedido.modificado === 1) {
+        alertaModificado = '<div class="alerta-modificado">⚠️ Pedido foi modificado pelo operador</div>';
+    }
+
+    // Classe adicional se modificado; "novo" só para animar a entrada na fila
+    let classeModificado = pedido.modificado === 1 ? 'pedido-modificado' : '';
+    let classeNovo = novo ? 'novo' : '';
+    // Só quem marcou horário tem prazo de verdade; os demais só usam o prazo para ordenar
+    let atributoPrazo = pedido.retirar_as ? `data-prazo="${pedido.prazo}"` : '';
+    let classeRisco = pedido.retirar_as && emRisco(pedido.prazo) ? 'em-risco' : '';
+
+    const template = document.createElement('template');
+    template.innerHTML = `
+        <div class="pedido-card ${classeModificado} ${classeNovo} ${classeRisco}" data-id="${pedido.id}" ${atributoPrazo}>
+            <button class="btn-editar-pedido" onclick="editarPedido(${pedido.id})">
+                Editar pedido ✏️
+            </button>
+
+            <div class="pedido-info">
+                ${alertaModificado}
+                <div class="pedido-cliente">${pedido.cliente}</div>
+                ${pedido.telefone ? `<div class="pedido-telefone">Telefone: ${pedido.telefone}</div>` : ''}
+                ${pedido.retirar_as ? `<div class="pedido-retirada">${textoRetirada(pedido)}</div>` : ''}
+
+                <div class="item-list">
+                    <h4>Itens</h4>
+                    ${itensHTML}
+                </div>
+            </div>
+
+            <div class="pedido-tempo" data-id="${pedido.id}" data-criado-em="${pedido.criado_em}">#${pedido.id} • ${formatarTempo(pedido.criado_em)}</div>
+            <button class="btn-pronto" onclick="marcarPronto(${pedido.id})">✓ Marcar como pronto</button>
+        </div>
+    `.trim();
+    const el = template.content.firstElementChild;
+    el.addEventListener('animationend', () => el.classList.remove('novo'), { once: true });
+    return el;
+}
+
+// Aplica a resposta da API mexendo só nos cards afetados, identificados pelo id do pedido
+function aplicarFila(data) {
+    const filaDiv = document.getElementById('fila');
+    let alterados, removidos, ordem;
+
+    if (data.completo) {
+        alterados = data.pedidos;
+        ordem = data.pedidos.map(pedido => pedido.id);
+        const presentes = new Set(ordem);
+        removidos = [...cards.keys()].filter(id => !presentes.has(id));
+    } else {
+        ({ alterados, removidos, ordem } = data);
+    }
+
+    removidos.forEach(id => {
+        const card = cards.get(id);
+        if (!card) return;
+        card.el.remove();
+        cards.delete(id);
+    });
+
+    alterados.forEach(pedido => {
+        const atual = cards.get(pedido.id);
+        if (atual && atual.versao === pedido.versao) return;
+        const el = criarCard(pedido, !atual);
+        if (atual) {
+            atual.el.replaceWith(el);
+        } else {
+            filaDiv.appendChild(el);
+        }
+        cards.set(pedido.id, { el, versao: pedido.versao });
+    });
+
+    // Só move os cards que estão fora de posição
+    let anterior = null;
+    ordem.forEach(id => {
+        const card = cards.get(id);
+        if (!card) return;
+        const esperado = anterior ? anterior.nextElementSibling : filaDiv.firstElementChild;
+        if (esperado !== card.el) {
+            if (anterior) {
+                anterior.after(card.el);
+            } else {
+                filaDiv.prepend(card.el);
+            }
+        }
+        anterior = card.el;
+    });
+
+    document.getElementById('vazio').style.display = cards.size ? 'none' : '';
+}
+
+function atualizarTempos() {
+    document.querySelectorAll('.pedido-tempo').forEach(el => {
+        el.textContent = `#${el.dataset.id} • ${formatarTempo(el.dataset.criadoEm)}`;
+    });
+    document.querySelectorAll('.pedido-card[data-prazo]').forEach(el => {
+        el.classList.toggle('em-risco', emRisco(el.dataset.prazo));
+    });
+}
+
+// Uma busca por vez: um delta só vale sobre a versão de onde foi pedido, então
+// pedidos que chegam no meio (SSE, cliques) esperam e saem numa busca só depois
+let carregando = false;
+let recarregar = false;
+
+function carregarPedidos() {
+    if (carregando) {
+        recarregar = true;
+        return;
+    }
+    carregando = true;
+    const url = versaoFila === null
+        ? '/api/pedidos-pendentes'
+        : '/api/pedidos-pendentes?since=' + versaoFila;
+    fetch(url, { cache: 'no-store' })
+        .then(response => response.status === 304 ? null : response.json())
+        .then(data => {
+            // Nunca volta a fila para uma versão mais velha que a já mostrada
+            if (!data || (versaoFila !== null && data.versao < versaoFila)) return;
+            aplicarFila(data);
+            versaoFila = data.versao;
+        })
+        .finally(() => {
+            carregando = false;
+            if (recarregar) {
+                recarregar = false;
+                carregarPedidos();
+            }
+        });
+}
+
+setInterval(atualizarTempos, 30000);
+
+
+function marcarPronto(pedidoId) {
+    fetch('/api/marcar-pronto', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({ id: pedidoId })
+    })
+    .then(response => response.json())
+    .then(data => {
+        carregarPedidos();
+    });
+}
+
+function cancelarItem(pedidoId, itemId, versao) {
+    fetch('/api/cancelar-item', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({ pedido_id: pedidoId, item_id: itemId, versao: versao })
+    })
+    .then(response => response.json())
+    .then(data => {
+        // Em caso de conflito (409) outra tela mexeu no pedido: basta recarregar a fila
+        carregarPedidos();
+    });
+}
+
+// Atualização em tempo real via stream; polling só enquanto o stream estiver fora
+let stream = null;
+let pollingTimer = null;
+
+function iniciarPolling() {
+    if (pollingTimer) return;
+    pollingTimer = setInterval(carregarPedidos, 2000);
+    document.getElementById('infoRefresh').textContent = 'Atualiza automaticamente a cada 2 segundos';
+}
+
+function pararPolling() {
+    if (!pollingTimer) return;
+    clearInterval(pollingTimer);
+    pollingTimer = null;
+}
+
+function conectarStream() {
+    if (!window.EventSource) {
+        iniciarPolling();
+        return;
+    }
+    stream = new EventSource('/api/pedidos-stream');
+    stream.addEventListener('versao', () => carregarPedidos());
+    stream.onopen = () => {
+        pararPolling();
+        document.getElementById('infoRefresh').textContent = 'Atualização em tempo real';
+    };
+    stream.onerror = () => {
+        iniciarPolling();
+        // O navegador reconecta sozinho; se desistiu, tentamos de novo mais tarde
+        if (stream.readyState === EventSource.CLOSED) {
+            setTimeout(conectarStream, 5000);
+        }
+    };
+}
+
+carregarPedidos();
+iniciarPolling();
+conectarStream();
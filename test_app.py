@@ -0,0 +1,250 @@
+"""Testes rápidos do app: rodam contra um banco novo numa pasta temporária (python -m pytest)"""
+import json
+import os
+import subprocess
+import sys
+from datetime import datetime
+
+import pytest
+
+import app as A
+import teste_carga
+
+
+@pytest.fixture(scope='module')
+def banco(tmp_path_factory):
+    A.DB_FILE = str(tmp_path_factory.mktemp('banco') / 'pedidos.db')
+    A.init_db()
+    # Banco já pronto: o cliente de teste não sobe vigia nem arquivador, que
+    # continuariam rodando depois que as conexões fossem fechadas
+    A._servico['pid'] = os.getpid()
+    yield
+    A.fechar_conexoes()
+
+
+def _item(descricao='1kg'):
+    return {'descricao': descricao, 'corte': 'Bife', 'temperar': 'Sim'}
+
+
+@pytest.mark.parametrize('busca, telefone', [
+    ('9999-1234', '(34) 99999-1234'),
+    ('999991234', '(34) 99999-1234'),
+    ('(34) 99999-1234', '(34) 99999-1234'),
+    ('34999991234', '(34) 99999-1234'),
+    ('9196', '34998179196'),
+    ('98179196', '34998179196'),
+    ('998179196', '34998179196'),
+])
+def test_busca_por_pedaco_do_telefone(banco, busca, telefone):
+    pedido_id = A.salvar_pedido('Cliente Telefone', telefone, [_item()])
+    assert pedido_id in [p['id'] for p in A.buscar_historico(busca)]
+
+
+def test_busca_por_telefone_nao_casa_numero_diferente(banco):
+    pedido_id = A.salvar_pedido('Outro Cliente', '34998170000', [_item()])
+    assert pedido_id not in [p['id'] for p in A.buscar_historico('9196')]
+
+
+@pytest.fixture
+def cliente(banco):
+    return A.app.test_client()
+
+
+@pytest.mark.parametrize('pedido', [
+    'x',
+    ['1kg'],
+    {'cliente': 'Ana', 'itens': ['1kg']},
+    {'cliente': 'Ana', 'itens': 'abc'},
+    {'cliente': 'Ana', 'itens': [{'descricao': 1000, 'corte': 'Bife'}]},
+    {'cliente': ['Ana'], 'itens': [{'descricao': '1kg'}]},
+])
+def test_lote_com_entrada_invalida_nao_derruba_as_outras(cliente, pedido):
+    resposta = cliente.post('/api/novo-pedido-lote', json={'pedidos': [pedido, {'cliente': 'Ana', 'itens': [_item()]}]})
+    assert resposta.status_code == 200
+    invalida, valida = resposta.json['resultados']
+    assert not invalida['sucesso'] and invalida['erro']
+    assert valida['sucesso'] and A.get_pedido(valida['id'])
+
+
+def test_lote_que_nao_e_lista(cliente):
+    resposta = cliente.post('/api/novo-pedido-lote', json={'pedidos': {'cliente': 'Ana'}})
+    assert resposta.status_code == 400
+
+
+@pytest.mark.parametrize('pedido', ['x', {'cliente': 'Ana', 'itens': 'abc'}, {'cliente': 'Ana', 'itens': ['1kg']}])
+def test_novo_pedido_invalido(cliente, pedido):
+    resposta = cliente.post('/api/novo-pedido', json=pedido)
+    assert resposta.status_code == 200 and not resposta.json['sucesso']
+
+
+@pytest.mark.parametrize('novo_item', ['2kg', ['2kg'], {'descricao': 2000}])
+def test_modificar_item_invalido(cliente, novo_item):
+    pedido_id = A.salvar_pedido('Cliente Item', '', [_item()])
+    resposta = cliente.post('/api/modificar-item', json={'pedido_id': pedido_id, 'item_index': 0, 'novo_item': novo_item})
+    assert resposta.status_code == 200 and not resposta.json['sucesso']
+
+
+@pytest.mark.parametrize('n, p, esperado', [
+    (100, 95, 95),
+    (100, 99, 99),
+    (100, 100, 100),
+    (10, 50, 5),
+    (10, 95, 10),
+    (1, 50, 1),
+    (3, 0, 1),
+])
+def test_percentil_nearest_rank(n, p, esperado):
+    assert teste_carga.percentil(list(range(1, n + 1)), p) == esperado
+
+
+def test_init_db_nao_sobe_threads(tmp_path):
+    # Num processo à parte: aqui o cliente de teste já subiu o serviço
+    codigo = ('import threading, app; app.DB_FILE = %r; app.init_db(); '
+              'print(sorted(t.name for t in threading.enumerate()))' % str(tmp_path / 'p.db'))
+    saida = subprocess.run([sys.executable, '-c', codigo], cwd=os.path.dirname(A.__file__),
+                           capture_output=True, text=True, check=True).stdout
+    assert 'vigia-banco' not in saida and 'arquivador' not in saida
+
+
+def test_arquivamento_conta_desde_que_ficou_pronto(banco):
+    antigo_pronto_agora = A.salvar_pedido('Arquivo Um', '', [_item()])
+    pronto_ha_tempo = A.salvar_pedido('Arquivo Dois', '', [_item()])
+    A.marcar_prontos([antigo_pronto_agora, pronto_ha_tempo])
+    with A.transacao() as conn:
+        conn.execute("UPDATE pedidos SET criado_em = datetime('now', '-40 days') WHERE id IN (?, ?)",
+                     (antigo_pronto_agora, pronto_ha_tempo))
+        conn.execute("UPDATE pedidos SET pronto_em = datetime('now', '-31 days') WHERE id = ?", (pronto_ha_tempo,))
+    A.arquivar_antigos(30)
+    with A.leitura() as conn:
+        vivos = {row[0] for row in conn.execute('SELECT id FROM pedidos')}
+        arquivados = {row[0] for row in conn.execute('SELECT id FROM pedidos_arquivo')}
+    assert antigo_pronto_agora in vivos
+    assert pronto_ha_tempo in arquivados
+
+
+@pytest.mark.parametrize('descricao, gramas, unidades', [
+    ('1kg', 1000, None),
+    ('500g', 500, None),
+    ('1,5 kg', 1500, None),
+    ('1.5kg', 1500, None),
+    ('1.000g', 1000, None),
+    ('2.500 g', 2500, None),
+    ('1.500,75 g', 1501, None),
+    ('1.000.000 g', 1000000, None),
+    ('0.500kg', 500, None),
+    ('1.500kg', 1500, None),
+    ('2.250 kg', 2250, None),
+    ('1.500,5 kg', 1500500, None),
+    ('1/2 kg', 500, None),
+    ('meio quilo', 500, None),
+    ('2 unidades', None, 2),
+    ('1kg e 2 pacotes', 1000, 2),
+    ('0.25 kg', 250, None),
+    ('picanha', None, None),
+])
+def test_interpretar_quantidade(descricao, gramas, unidades):
+    assert A.interpretar_quantidade(descricao) == (gramas, unidades)
+
+
+def test_em_risco_so_conta_quem_marcou_horario(banco):
+    sem_horario = A.salvar_pedido('Risco Sem Horario', '', [_item()])
+    agora = datetime.now().strftime('%H:%M')
+    com_horario = A.salvar_pedido('Risco Com Horario', '', [{'descricao': '1kg', 'corte': 'Cubos', 'temperar': 'Não'}],
+                                  retirar_as=agora)
+    with A.transacao() as conn:
+        # Prazo implícito já vencido: antes contava como em risco
+        conn.execute("UPDATE pedidos SET prazo = datetime('now', '-5 minutes') WHERE id = ?", (sem_horario,))
+    A._cache_fila.carregar()
+    cache = A.cache_fila()
+    assert cache.em_risco() == 1
+    lotes = {lote['corte']: lote for lote in json.loads(cache.lotes_json()[1])}
+    assert lotes['Bife']['prazo_retirada'] is None
+    assert lotes['Cubos']['prazo_retirada'] == A.get_pedido(com_horario)['prazo'].replace(' ', 'T') + 'Z'
+
+
+def test_salvar_pedidos_grava_os_itens_de_cada_pedido(banco):
+    ids = A.salvar_pedidos([
+        {'cliente': 'Lote Um', 'telefone': '', 'retirar_as': None, 'itens': [_item('1kg'), _item('500g')]},
+        {'cliente': 'Lote Dois', 'telefone': '', 'retirar_as': None, 'itens': [_item('2kg')]},
+    ])
+    assert [[item['descricao'] for item in json.loads(A.get_pedido(pid)['itens'])] for pid in ids] == [['1kg', '500g'], ['2kg']]
+
+
+@pytest.mark.parametrize('rota, corpo', [
+    ('/api/cancelar-item', {}),
+    ('/api/modificar-item', {'novo_item': _item('3kg')}),
+])
+def test_versao_antiga_recebe_409_com_o_pedido_atual(cliente, rota, corpo):
+    pedido_id = A.salvar_pedido('Cliente Versao', '', [_item('1kg'), _item('2kg')])
+    antiga = A.get_pedido(pedido_id)['versao']
+    resposta = cliente.post('/api/modificar-item', json={
+        'pedido_id': pedido_id, 'item_index': 0, 'novo_item': _item('5kg'), 'versao': antiga})
+    atual = resposta.json['versao']
+    assert atual != antiga
+
+    resposta = cliente.post(rota, json=dict(corpo, pedido_id=pedido_id, item_index=1, versao=antiga))
+    assert resposta.status_code == 409
+    assert resposta.json['pedido']['versao'] == atual
+    assert [item['descricao'] for item in resposta.json['pedido']['itens']] == ['5kg', '2kg']
+
+
+def test_idempotency_key_repete_a_resposta_e_recusa_outra_rota(cliente):
+    cabecalhos = {'Idempotency-Key': 'teste-idempotencia'}
+    pedido = {'cliente': 'Cliente Idempotente', 'itens': [_item()]}
+    primeira = cliente.post('/api/novo-pedido', json=pedido, headers=cabecalhos)
+    repetida = cliente.post('/api/novo-pedido', json=pedido, headers=cabecalhos)
+    assert repetida.json == primeira.json
+    assert repetida.headers['Idempotent-Replayed'] == 'true'
+    assert [p['cliente'] for p in A.buscar_historico('Cliente Idempotente')] == ['Cliente Idempotente']
+
+    outra_rota = cliente.post('/api/marcar-pronto', json={'id': primeira.json['id']}, headers=cabecalhos)
+    assert outra_rota.status_code == 422
+    assert A.get_pedido(primeira.json['id'])['status'] == 'pendente'
+
+
+def test_transacao_aninhada_desfaz_so_o_proprio_savepoint(banco):
+    with A.transacao():
+        fora = A.salvar_pedido('Aninhada Fora', '', [_item()])
+        ganchos = len(A._local.apos_commit)
+        with pytest.raises(RuntimeError):
+            with A.transacao():
+                dentro = A.salvar_pedido('Aninhada Dentro', '', [_item()])
+                assert len(A._local.apos_commit) > ganchos
+                raise RuntimeError
+        assert len(A._local.apos_commit) == ganchos
+    assert A.get_pedido(fora) is not None
+    assert A.get_pedido(dentro) is None
+    ordem = A.cache_fila().ordem()
+    assert fora in ordem and dentro not in ordem
+
+
+def test_since_devolve_delta_ou_fila_inteira(cliente, monkeypatch):
+    versao = cliente.get('/api/pedidos-pendentes').json['versao']
+    pedido_id = A.salvar_pedido('Cliente Delta', '', [_item()])
+
+    delta = cliente.get(f'/api/pedidos-pendentes?since={versao}').json
+    assert not delta['completo']
+    assert [p['id'] for p in delta['alterados']] == [pedido_id]
+    assert pedido_id in delta['ordem']
+
+    monkeypatch.setattr(A, 'DELTA_MAX_VERSOES', 0)
+    atrasado = cliente.get(f'/api/pedidos-pendentes?since={versao}').json
+    assert atrasado['completo']
+    assert pedido_id in [p['id'] for p in atrasado['pedidos']]
+
+
+def test_cache_da_fila_igual_ao_banco_depois_das_escritas(banco):
+    pedido_id = A.salvar_pedido('Cliente Cache', '', [_item('1kg'), _item('2kg')])
+    outro = A.salvar_pedido('Cliente Cache Dois', '', [_item()], retirar_as='06:00')
+    pronto = A.salvar_pedido('Cliente Cache Pronto', '', [_item()])
+    A.modificar_item_pedido(pedido_id, json.loads(A.get_pedido(pedido_id)['itens'])[0]['id'], _item('4kg'))
+    A.cancelar_item_pedido(outro, json.loads(A.get_pedido(outro)['itens'])[0]['id'])
+    A.marcar_prontos([pronto])
+
+    _, corpo = A.cache_fila().completo()
+    assert [(p['id'], p['versao'], p['itens']) for p in json.loads(corpo)] == [
+        (p['id'], p['versao'], json.loads(p['itens'])) for p in A.get_pedidos_pendentes()
+    ]
+    recarregado = A.CacheFila()
+    recarregado.carregar()
+    assert recarregado.completo()[1] == corpo
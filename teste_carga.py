@@ -0,0 +1,318 @@
+"""Teste de carga do sistema de pedidos: simula um sábado de movimento.
+
+N terminais de operador mandam pedidos novos e M telas de produção acompanham a
+fila como o navegador faz (polling com since=), marcando pedidos como prontos e
+cancelando itens. No fim sai um relatório por rota: vazão, latência p50/p95/p99
+e erros, com os 503 de banco travado contados à parte.
+
+Exemplos:
+    # sobe um servidor num banco novo com 200 mil pedidos de histórico
+    python teste_carga.py --iniciar-servidor --db /tmp/carga.db --semear 200000
+
+    # contra um servidor que já está rodando
+    python teste_carga.py --url http://localhost:5000 --operadores 4 --telas 6 --duracao 60
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+CORTES = [
+    'Bife', 'Bife fino', 'Bife grosso', 'Grelha', 'Iscas', 'Cubos', 'Feijoada', 'Inteiro',
+    'Peça', 'Medalhão', 'Moído X vezes', 'Para panela', 'Para picadinho',
+    'Para strogonoff', 'Para espeto', 'NAO IMPORTA',
+]
+TEMPERAR = ['Sim', 'Não', 'Não Importa']
+QUANTIDADES = ['500g', '1kg', '1,5kg', '2kg', '300g', '2 unidades', '1 peça']
+CLIENTES = ['João', 'Maria', 'José', 'Ana', 'Paulo', 'Carla', 'Pedro', 'Lúcia', 'Marcos', 'Rita']
+
+def item_aleatorio():
+    item = {
+        'descricao': random.choice(QUANTIDADES),
+        'corte': random.choice(CORTES),
+        'temperar': random.choice(TEMPERAR),
+    }
+    if item['corte'] == 'Moído X vezes':
+        item['moido'] = str(random.randint(1, 3))
+    return item
+
+def pedido_aleatorio():
+    return {
+        'cliente': f'{random.choice(CLIENTES)} {random.randint(1, 999)}',
+        'telefone': f'(34) 9{random.randint(1000, 9999)}-{random.randint(1000, 9999)}',
+        'retirar_as': f'{random.randint(8, 18):02d}:{random.choice(["00", "15", "30", "45"])}',
+        'itens': [item_aleatorio() for _ in range(random.randint(1, 4))],
+    }
+
+# Banco pré-populado
+
+def semear(db, quantidade, lote=5000):
+    """Cria o esquema pelo próprio app, insere um histórico de pedidos já prontos e arquiva os antigos"""
+    os.environ['PEDIDOS_DB'] = db
+    import app as servidor
+    servidor.DB_FILE = db
+    servidor.init_db()
+
+    inicio = datetime.now(timezone.utc) - timedelta(days=365)
+    passo = timedelta(days=365) / max(quantidade, 1)
+    feitos = 0
+    while feitos < quantidade:
+        n = min(lote, quantidade - feitos)
+        with servidor.transacao() as conn:
+            proximo = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM pedidos").fetchone()[0]
+            pedidos, itens = [], []
+            for i in range(n):
+                pedido = pedido_aleatorio()
+                pedido_id = proximo + i
+                criado_em = (inicio + passo * (feitos + i)).strftime('%Y-%m-%d %H:%M:%S')
+                pedidos.append((pedido_id, pedido['cliente'], pedido['telefone'], criado_em,
+                                'pronto', criado_em, pedido['retirar_as']))
+                itens.extend(
+                    (pedido_id, posicao, item['descricao'], item['corte'],
+                     int(item['moido']) if 'moido' in item else None, item['temperar'])
+                    for posicao, item in enumerate(pedido['itens'])
+                )
+            conn.executemany('''
+                INSERT INTO pedidos (id, cliente, telefone, criado_em, status, pronto_em, retirar_as)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', pedidos)
+            conn.executemany('''
+                INSERT INTO pedido_itens (pedido_id, posicao, descricao, corte, moido, temperar)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', itens)
+        feitos += n
+        print(f'  semeados {feitos}/{quantidade}', end='\r', flush=True)
+    print()
+    # Deixa o banco como o de uma loja que já roda há um ano: o que passou do prazo
+    # já está no arquivo, e o servidor medido não arquiva nada durante a carga.
+    # Sem tráfego para proteger, arquiva em lotes grandes e sem a pausa de arquivar_antigos
+    arquivados = 0
+    while True:
+        movidos = servidor.arquivar_lote(limite=lote)
+        if not movidos:
+            break
+        arquivados += movidos
+    print(f'  arquivados {arquivados}')
+
+# Cliente HTTP e métricas
+
+class Metricas:
+    """Latências e erros por rota, compartilhados entre as threads"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencias = defaultdict(list)
+        self.erros = defaultdict(lambda: defaultdict(int))
+
+    def registrar(self, rota, segundos, status):
+        with self.lock:
+            self.latencias[rota].append(segundos)
+            if status is None:
+                self.erros[rota]['conexão'] += 1
+            elif status == 503:
+                self.erros[rota]['banco travado (503)'] += 1
+            elif status >= 400 and status != 409:
+                self.erros[rota][f'HTTP {status}'] += 1
+
+class Cliente:
+    """Conexão keep-alive de um terminal simulado"""
+
+    def __init__(self, url, metricas):
+        partes = urlsplit(url)
+        self.host, self.porta = partes.hostname, partes.port or 80
+        self.metricas = metricas
+        self.conn = None
+
+    def requisitar(self, metodo, caminho, corpo=None, rota=None):
+        rota = rota or caminho.split('?')[0]
+        dados = json.dumps(corpo).encode() if corpo is not None else None
+        cabecalhos = {'Content-Type': 'application/json'} if dados else {}
+        inicio = time.perf_counter()
+        try:
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.porta, timeout=30)
+            self.conn.request(metodo, caminho, body=dados, headers=cabecalhos)
+            resposta = self.conn.getresponse()
+            conteudo = resposta.read()
+            status = resposta.status
+        except (OSError, http.client.HTTPException):
+            self.conn = None
+            self.metricas.registrar(rota, time.perf_counter() - inicio, None)
+            return None, None
+        self.metricas.registrar(rota, time.perf_counter() - inicio, status)
+        if status == 200 and conteudo:
+            return status, json.loads(conteudo)
+        return status, None
+
+# Terminais simulados
+
+def operador(url, metricas, parar, intervalo):
+    cliente = Cliente(url, metricas)
+    while not parar.is_set():
+        cliente.requisitar('POST', '/api/novo-pedido', pedido_aleatorio())
+        parar.wait(random.expovariate(1 / intervalo))
+
+def tela_producao(url, metricas, parar, intervalo, chance_pronto, chance_cancelar):
+    """Segue a fila como o navegador: fila inteira na primeira vez, depois só deltas"""
+    cliente = Cliente(url, metricas)
+    fila = {}
+    versao = None
+    while not parar.is_set():
+        caminho = '/api/pedidos-pendentes' + (f'?since={versao}' if versao is not None else '')
+        status, dados = cliente.requisitar('GET', caminho, rota='/api/pedidos-pendentes')
+        if dados:
+            if dados.get('completo', True):
+                fila = {p['id']: p for p in dados['pedidos']}
+            else:
+                for pedido_id in dados['removidos']:
+                    fila.pop(pedido_id, None)
+                fila.update((p['id'], p) for p in dados['alterados'])
+            versao = dados.get('versao')
+
+        if fila and random.random() < chance_pronto:
+            pedido_id = random.choice(list(fila))
+            cliente.requisitar('POST', '/api/marcar-pronto', {'id': pedido_id})
+        if fila and random.random() < chance_cancelar:
+            pedido = random.choice(list(fila.values()))
+            if pedido['itens']:
+                item = random.choice(pedido['itens'])
+                cliente.requisitar('POST', '/api/cancelar-item', {
+                    'pedido_id': pedido['id'], 'item_id': item['id'], 'versao': pedido.get('versao'),
+                })
+        parar.wait(intervalo)
+
+# Relatório
+
+def percentil(valores, p):
+    """Percentil pelo método nearest-rank (valores já ordenados)"""
+    if not valores:
+        return 0.0
+    indice = max(0, min(len(valores) - 1, math.ceil(p / 100 * len(valores)) - 1))
+    return valores[indice]
+
+def relatorio(metricas, duracao):
+    linhas = []
+    for rota in sorted(metricas.latencias):
+        valores = sorted(metricas.latencias[rota])
+        linhas.append({
+            'rota': rota,
+            'requisicoes': len(valores),
+            'por_segundo': len(valores) / duracao,
+            'p50_ms': percentil(valores, 50) * 1000,
+            'p95_ms': percentil(valores, 95) * 1000,
+            'p99_ms': percentil(valores, 99) * 1000,
+            'max_ms': valores[-1] * 1000,
+            'erros': dict(metricas.erros[rota]),
+        })
+    return linhas
+
+def imprimir(linhas, duracao):
+    print(f'\nDuração: {duracao:.1f}s')
+    print(f'{"rota":<28}{"req":>8}{"req/s":>9}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"max ms":>9}  erros')
+    for l in linhas:
+        erros = ', '.join(f'{k}: {v}' for k, v in l['erros'].items()) or '-'
+        print(f'{l["rota"]:<28}{l["requisicoes"]:>8}{l["por_segundo"]:>9.1f}{l["p50_ms"]:>9.1f}'
+              f'{l["p95_ms"]:>9.1f}{l["p99_ms"]:>9.1f}{l["max_ms"]:>9.1f}  {erros}')
+    travados = sum(l['erros'].get('banco travado (503)', 0) for l in linhas)
+    total = sum(l['requisicoes'] for l in linhas)
+    print(f'\nTotal: {total} requisições ({total / duracao:.1f}/s), {travados} erros de banco travado')
+
+def esperar_servidor(url, limite=15):
+    partes = urlsplit(url)
+    fim = time.monotonic() + limite
+    while time.monotonic() < fim:
+        try:
+            conn = http.client.HTTPConnection(partes.hostname, partes.port or 80, timeout=1)
+            conn.request('GET', '/api/pedidos-pendentes')
+            conn.getresponse().read()
+            return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--operadores', type=int, default=4, help='terminais mandando pedidos')
+    parser.add_argument('--telas', type=int, default=6, help='telas de produção')
+    parser.add_argument('--duracao', type=float, default=30, help='segundos de teste')
+    parser.add_argument('--intervalo-pedidos', type=float, default=2.0,
+                        help='média de segundos entre pedidos de cada operador')
+    parser.add_argument('--intervalo-polling', type=float, default=2.0)
+    parser.add_argument('--chance-pronto', type=float, default=0.3,
+                        help='chance de cada tela marcar um pedido como pronto a cada ciclo')
+    parser.add_argument('--chance-cancelar', type=float, default=0.05)
+    parser.add_argument('--db', help='arquivo do banco (para --semear e --iniciar-servidor)')
+    parser.add_argument('--semear', type=int, default=0, help='pedidos de histórico a inserir antes do teste')
+    parser.add_argument('--iniciar-servidor', action='store_true',
+                        help='sobe o app.py num subprocesso apontando para --db')
+    parser.add_argument('--async', dest='modo_async', action='store_true',
+                        help='com --iniciar-servidor: usar o modo assíncrono')
+    parser.add_argument('--workers', type=int, default=1, help='com --iniciar-servidor: processos')
+    parser.add_argument('--json', help='também grava o relatório neste arquivo')
+    args = parser.parse_args()
+
+    if (args.semear or args.iniciar_servidor) and not args.db:
+        parser.error('--semear e --iniciar-servidor precisam de --db')
+
+    if args.semear:
+        print(f'Semeando {args.semear} pedidos em {args.db}...')
+        semear(args.db, args.semear)
+
+    servidor = None
+    if args.iniciar_servidor:
+        porta = urlsplit(args.url).port or 5000
+        comando = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py'),
+                   '--porta', str(porta), '--workers', str(args.workers)]
+        if args.modo_async:
+            comando.append('--async')
+        servidor = subprocess.Popen(comando, env={**os.environ, 'PEDIDOS_DB': args.db},
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                    start_new_session=True)
+    try:
+        if not esperar_servidor(args.url):
+            sys.exit(f'Servidor não respondeu em {args.url}')
+
+        metricas = Metricas()
+        parar = threading.Event()
+        threads = [
+            threading.Thread(target=operador, args=(args.url, metricas, parar, args.intervalo_pedidos))
+            for _ in range(args.operadores)
+        ] + [
+            threading.Thread(target=tela_producao, args=(args.url, metricas, parar, args.intervalo_polling,
+                                                         args.chance_pronto, args.chance_cancelar))
+            for _ in range(args.telas)
+        ]
+        print(f'{args.operadores} operadores, {args.telas} telas, {args.duracao:.0f}s contra {args.url}')
+        inicio = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        parar.wait(args.duracao)
+        parar.set()
+        for thread in threads:
+            thread.join()
+        duracao = time.perf_counter() - inicio
+    finally:
+        if servidor:
+            # O servidor de desenvolvimento tem um processo filho (reloader): derruba o grupo todo
+            os.killpg(servidor.pid, signal.SIGTERM)
+            servidor.wait()
+
+    linhas = relatorio(metricas, duracao)
+    imprimir(linhas, duracao)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'duracao': duracao, 'args': vars(args), 'rotas': linhas}, f, indent=2, ensure_ascii=False)
+
+if __name__ == '__main__':
+    main()